@@ -0,0 +1,187 @@
+# 按内容寻址的分析缓存 - 解码后的PCM、各分辨率的幅值谱和1Hz能量向量
+# 键 = 音频内容哈希 + 结果类型 + 参数；每个条目是 cache_stft/ 下的一个 .npz 文件
+# 命中时更新文件修改时间，超过容量上限时删除最久未使用的条目（多个进程共享同一目录也是安全的）
+# 总大小在第一次写入时扫描一次目录，之后按写入和删除增量维护，超过上限时才重新扫描并淘汰
+# （其他进程的写入只在淘汰扫描时计入，多进程共享时总大小可能暂时超过上限）
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+
+CACHE_DIR = 'cache_stft'
+CACHE_MAX_BYTES = 4 * 1024 ** 3   # 默认容量上限 4GB
+CACHE_VERSION = 1                 # 结果的计算方式变化时递增，使旧条目失效
+EVICT_TARGET = 0.9                # 淘汰到容量上限的比例，避免每次写入都触发淘汰
+
+
+class AnalysisCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+        """
+        磁盘缓存
+
+        参数:
+            directory: 缓存目录
+            max_bytes: 容量上限（字节），0 表示禁用缓存
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+        self._lock = threading.Lock()
+        self._total = None   # 条目总大小（字节），None 表示尚未扫描
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def key(self, content_hash, kind, params):
+        """
+        条目的键
+
+        参数:
+            content_hash: 音频内容的sha256
+            kind: 结果类型，如 'pcm'、'spectrum'
+            params: 影响结果的参数（可JSON序列化）
+        """
+        text = json.dumps([CACHE_VERSION, content_hash, kind, params], sort_keys=True)
+        return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + '.npz')
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def get(self, key):
+        """
+        读取条目
+
+        返回:
+            {数组名: 数组}，未命中时返回 None
+        """
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with np.load(path, allow_pickle=False) as data:
+                arrays = {name: data[name] for name in data.files}
+            os.utime(path)  # 记录最近使用时间
+        except (OSError, ValueError):
+            self._count('misses')
+            return None
+        self._count('hits')
+        return arrays
+
+    def contains(self, key):
+        """条目是否存在（不计入命中统计）"""
+        return self.enabled and os.path.exists(self._path(key))
+
+    def remove(self, key):
+        """删除条目（不存在时忽略）"""
+        path = self._path(key)
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return
+        self._adjust(-size)
+
+    def total_bytes(self):
+        """条目总大小：第一次调用时扫描目录，之后由写入、删除和淘汰增量维护"""
+        with self._lock:
+            if self._total is None:
+                self._total = sum(size for _, size, _ in self.entries())
+            return self._total
+
+    def _adjust(self, delta):
+        with self._lock:
+            if self._total is not None:
+                self._total = max(self._total + delta, 0)
+
+    def put(self, key, **arrays):
+        """写入条目（先写临时文件再替换），超过容量上限时淘汰旧条目"""
+        if not self.enabled:
+            return
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            previous = os.path.getsize(path)   # 覆盖已有条目时只计入大小的变化
+        except OSError:
+            previous = 0
+        try:
+            with open(tmp_path, 'wb') as f:
+                np.savez(f, **arrays)
+                size = f.tell()
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"写入缓存失败: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            return
+        self._count('writes')
+        self._adjust(size - previous)
+        if self.total_bytes() > self.max_bytes:
+            self.evict()
+
+    def entries(self):
+        """所有条目 [(最近使用时间, 大小, 路径)]"""
+        result = []
+        if not os.path.isdir(self.directory):
+            return result
+        for sub in os.listdir(self.directory):
+            folder = os.path.join(self.directory, sub)
+            if not os.path.isdir(folder):
+                continue
+            for name in os.listdir(folder):
+                if not name.endswith('.npz'):
+                    continue
+                path = os.path.join(folder, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue  # 被其他进程删除
+                result.append((stat.st_mtime, stat.st_size, path))
+        return result
+
+    def evict(self):
+        """总大小超过上限时按最近使用时间从旧到新删除条目（重新扫描目录，同时校正维护的总大小）"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total > self.max_bytes:
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes * EVICT_TARGET:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                self._count('evictions')
+        with self._lock:
+            self._total = total
+
+    def summary(self, stats=None):
+        """统计信息的一行文本"""
+        stats = stats or self.stats
+        lookups = stats['hits'] + stats['misses']
+        rate = stats['hits'] / lookups * 100 if lookups else 0
+        return (f"缓存: 命中 {stats['hits']}, 未命中 {stats['misses']} ({rate:.1f}% 命中), "
+                f"写入 {stats['writes']}, 淘汰 {stats['evictions']}")
+
+
+_cache = AnalysisCache()
+
+
+def configure(directory=CACHE_DIR, max_bytes=CACHE_MAX_BYTES):
+    """设置进程内使用的缓存目录和容量上限（max_bytes=0 禁用缓存）"""
+    global _cache
+    if _cache.directory != directory or _cache.max_bytes != max_bytes:
+        _cache = AnalysisCache(directory, max_bytes)
+    return _cache
+
+
+def get_cache():
+    """当前进程使用的缓存"""
+    return _cache
@@ -0,0 +1,683 @@
+# 进程池分析后端 - 各分析阶段在独立进程中执行，不受GIL限制
+# 解码后的音频和中间能量谱放在 multiprocessing.shared_memory 中：由主进程创建和释放，
+# 工作进程按名称映射（零拷贝），任务参数里只传递共享内存名称、形状和元数据
+# 每首歌的分析阶段组成依赖图（见 STAGES），主进程按图调度：依赖完成的阶段进入就绪队列，
+# 不同歌曲的阶段交错执行；暂停/停止在阶段内的计算分块之间生效（cancellation），
+# 被停止的阶段不记为完成，已算好的部分保存在检查点中
+# 新歌曲只有在估计的峰值内存放得进内存预算时才开始处理（见 MemoryBudget）
+# 每个阶段完成后记入输出目录的清单，重新处理时跳过输入和参数都未变化的阶段（见 stage_manifest）
+# 歌曲按时长从长到短开始处理；批次末尾进程空闲时，把空闲的核分给正在提交的阶段做分段并行FFT
+# 计算精度（precision）在主进程解码时和每个阶段的工作进程中生效，共享内存中的采样即为该精度
+import io
+import os
+import queue
+import contextlib
+import time
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import shared_memory
+import numpy as np
+import psutil
+import analysis_cache
+import cancellation
+import fft_tuner
+import power_spectrum
+import precision
+import thread_budget
+import spectral_engine
+from spectral_engine import SpectralRequest
+from audio_source import AudioSource, get_audio_info
+from stage_manifest import StageManifest, file_fingerprint
+
+# 能量谱参数（与 power_spectrum.get_bin_energy 的默认值一致）
+ENERGY_STEP_HZ = 1
+ENERGY_HOP_MS = 25
+
+MB = 1024 * 1024
+
+# 各阶段的峰值内存估计（不含工作进程本身的导入开销）: 阶段 -> (固定部分, 每秒音频的增量)
+# 数值来自 44.1kHz 立体声、matplotlib 渲染的实测，频谱图宽度随时长增长
+STAGE_MEMORY = {
+    'stft': (780 * MB, 3 * MB),
+    'stft_3000': (180 * MB, 7 * MB),
+    'energy': (110 * MB, 1 * MB),
+    'power': (150 * MB, 0),
+    'power_plt': (150 * MB, 0),
+    'power_aweighted': (150 * MB, 0),
+}
+WORKER_BASE_MEMORY = 110 * MB   # 空闲工作进程的常驻内存（导入numpy/scipy/matplotlib等）
+MEMORY_BUDGET_FRACTION = 0.75   # 未指定预算时使用启动时可用内存的比例
+MEMORY_RESERVE_FRACTION = 0.1   # 系统始终保留的可用内存比例
+
+
+class SharedArray:
+    def __init__(self, name, shape, dtype):
+        """
+        共享内存中的数组描述（可pickle，只包含名称和形状）
+
+        参数:
+            name: 共享内存名称
+            shape: 数组形状
+            dtype: 数据类型字符串
+        """
+        self.name = name
+        self.shape = tuple(shape)
+        self.dtype = dtype
+
+    def attach(self):
+        """
+        映射共享内存（不复制数据）
+
+        返回:
+            shm: SharedMemory 对象，数组用完后需要关闭
+            array: 以共享内存为缓冲的数组
+        """
+        shm = shared_memory.SharedMemory(name=self.name)
+        return shm, np.ndarray(self.shape, dtype=self.dtype, buffer=shm.buf)
+
+
+def share_array(shape, dtype, data=None):
+    """
+    在共享内存中创建数组（由调用方负责 close 和 unlink）
+
+    返回:
+        shm: SharedMemory 对象
+        array: 以共享内存为缓冲的数组
+        desc: 传给工作进程的 SharedArray
+    """
+    dtype = np.dtype(dtype)
+    size = max(int(np.prod(shape)) * dtype.itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    if data is not None:
+        array[...] = data
+    return shm, array, SharedArray(shm.name, shape, dtype.str)
+
+
+class SharedSong:
+    def __init__(self, name, source):
+        """
+        主进程持有的一首歌的共享内存（解码后的采样和能量谱）
+
+        参数:
+            name: music 目录下的文件名
+            source: 已解码的AudioSource
+        """
+        self.name = name
+        self.path = source.path
+        self.sr = source.sr
+        self.channels = source.channels
+        self.content_hash = source.content_hash
+        self._segments = []
+        self.audio = self._share(source.samples.shape, source.samples.dtype, source.samples)
+        # 能量谱的长度只取决于窗口大小，先分配好，由能量谱任务在工作进程中直接写入
+        n_fft, _ = SpectralRequest(ENERGY_STEP_HZ, ENERGY_HOP_MS).frame_params(self.sr)
+        self.energy = self._share((n_fft // 2 + 1,), np.float64)
+
+    def _share(self, shape, dtype, data=None):
+        shm, _, desc = share_array(shape, dtype, data)
+        self._segments.append(shm)
+        return desc
+
+    def release(self):
+        """关闭并删除共享内存"""
+        for shm in self._segments:
+            shm.close()
+            shm.unlink()
+        self._segments = []
+
+
+def _attach_source(song, with_energy):
+    """在工作进程中把共享内存包装成AudioSource（能量谱预先放入缓存）"""
+    segments = []
+    shm, samples = song['audio'].attach()
+    segments.append(shm)
+    source = AudioSource(song['path'], samples, song['sr'], song['channels'], song['content_hash'])
+    if with_energy:
+        shm, energy = song['energy'].attach()
+        segments.append(shm)
+        n_fft, _ = SpectralRequest(ENERGY_STEP_HZ, ENERGY_HOP_MS).frame_params(song['sr'])
+        freq_bins = np.fft.rfftfreq(n_fft, 1 / song['sr'])
+        source.derived[('bin_energy', ENERGY_STEP_HZ, ENERGY_HOP_MS)] = (freq_bins, energy)
+    return source, segments
+
+
+def _stage_stft(source, song, options):
+    import stft_unified
+    stft_unified.main(source, renderer=options['renderer'], export_csv=options.get('export_csv', False))
+
+
+def _stage_stft_3000(source, song, options):
+    import stft_3000_detailed
+    stft_3000_detailed.main(source, renderer=options['renderer'])
+
+
+def _stage_energy(source, song, options):
+    _, energy = power_spectrum.get_bin_energy(source, ENERGY_STEP_HZ, ENERGY_HOP_MS)
+    shm, out = song['energy'].attach()
+    out[:] = energy
+    del out
+    shm.close()
+
+
+def _stage_power(source, song, options):
+    import power
+    power.main(source)
+
+
+def _stage_power_plt(source, song, options):
+    import power_plt
+    power_plt.main(source)
+
+
+def _stage_power_aweighted(source, song, options):
+    import power_aweighted
+    power_aweighted.main(source)
+
+
+class Stage:
+    def __init__(self, func, label, done_message, deps=(), needs_energy=False, outputs=None, params=None,
+                 option_keys=(), optional_outputs=None):
+        """
+        阶段图中的一个节点
+
+        参数:
+            func: func(source, song, options)，在工作进程中执行
+            label: 日志中的显示名
+            done_message: 完成后写入日志的文本
+            deps: 依赖的阶段名（全部完成后才能开始）
+            needs_energy: 是否需要把共享的能量谱放入AudioSource缓存
+            outputs: 输出文件名（相对输出目录）；None 表示只产生内存中的中间结果，不记入清单
+            params: 影响输出的参数（记入清单，变化时重做）
+            option_keys: 同样影响输出的运行选项（如 renderer）
+            optional_outputs: {选项名: 文件名列表}，对应选项开启时才产生的输出
+        """
+        self.func = func
+        self.label = label
+        self.done_message = done_message
+        self.deps = tuple(deps)
+        self.needs_energy = needs_energy
+        self.outputs = outputs
+        self.params = params or {}
+        self.option_keys = tuple(option_keys)
+        self.optional_outputs = optional_outputs or {}
+
+    def run_params(self, options):
+        """本次运行记入清单的参数"""
+        params = dict(self.params)
+        # 只在选项中出现的才记入（如精度只在非默认值时出现，默认设置下清单与以前相同）
+        params.update({key: options[key] for key in self.option_keys if key in options})
+        return params
+
+    def output_names(self, options):
+        """本次运行应当存在的输出文件（加上已开启的选项对应的输出）"""
+        names = list(self.outputs)
+        for key, extra in self.optional_outputs.items():
+            if options.get(key):
+                names.extend(extra)
+        return names
+
+
+# 每首歌的阶段图：频谱图阶段与能量谱互相独立，三个能量输出只依赖能量谱
+# （能量图直接使用内存中的能量，不依赖能量CSV）；移动原始文件需要全部阶段完成，由 on_song_done 执行
+ENERGY_PARAMS = {'freq_min': 0, 'freq_max': 20000, 'freq_step': ENERGY_STEP_HZ, 'hop_ms': ENERGY_HOP_MS}
+STAGES = {
+    'stft': Stage(_stage_stft, 'STFT Unified', 'STFT Finished!',
+                  outputs=['data-4000.png', 'data-8000.png', 'data-20000.png', 'data.spec'],
+                  params={'freq_ranges': [4000, 8000, 20000], 'hop_ms': 50, 'step_hz': 10, 'floor_db': -120.0},
+                  option_keys=['renderer', 'precision', 'fft_plans', 'export_csv'],
+                  optional_outputs={'export_csv': ['data.csv']}),
+    'stft_3000': Stage(_stage_stft_3000, 'STFT 3000 Detailed', 'STFT-3000 Finished!',
+                       outputs=['data-3000Hz-3HzStep.png'],
+                       params={'max_freq': 3000, 'step_hz': 3, 'hop_ms': 50, 'multirate': True},
+                       option_keys=['renderer', 'precision', 'fft_plans']),
+    'energy': Stage(_stage_energy, 'Bin Energy', 'STFT-Power-Energy Finished!'),
+    'power': Stage(_stage_power, 'Power CSV', 'STFT-Power-Csv Finished!', ['energy'], True,
+                   outputs=['frequency_energy.csv'], params=dict(ENERGY_PARAMS, freq_tolerance=1.0),
+                   option_keys=['precision', 'fft_plans']),
+    'power_plt': Stage(_stage_power_plt, 'Power PLT', 'STFT-Power-Plt Finished!', ['energy'], True,
+                       outputs=['frequency_energy.png'], params=dict(ENERGY_PARAMS, freq_tolerance=1.0),
+                       option_keys=['precision', 'fft_plans']),
+    'power_aweighted': Stage(_stage_power_aweighted, 'Power A-Weighted', 'STFT-Power-Plt-A-Weighting Finished!',
+                             ['energy'], True,
+                             outputs=['frequency_energy_aweighted.csv', 'frequency_energy_aweighted.png'],
+                             params=dict(ENERGY_PARAMS, freq_tolerance=3, aweighting=True),
+                             option_keys=['precision', 'fft_plans']),
+}
+# 没有依赖的阶段在歌曲解码后立即并行执行，决定一首歌的峰值内存
+ROOT_STAGES = [name for name, stage in STAGES.items() if not stage.deps]
+
+
+def stale_stages(manifest, options):
+    """
+    需要执行的阶段：清单中没有、参数变化或输出缺失的阶段，加上它们依赖的中间阶段
+
+    参数:
+        manifest: 已设置输入指纹的 StageManifest
+        options: 运行选项
+    """
+    stale = {name for name, stage in STAGES.items()
+             if stage.outputs is not None
+             and not manifest.is_fresh(name, stage.run_params(options), stage.output_names(options))}
+    pending = list(stale)
+    while pending:
+        for dep in STAGES[pending.pop()].deps:
+            if dep not in stale:
+                stale.add(dep)
+                pending.append(dep)
+    return stale
+
+
+def ready_stages(done, started):
+    """
+    依赖已全部完成、尚未开始的阶段（按 STAGES 的顺序）
+
+    参数:
+        done: 已成功完成的阶段名集合
+        started: 已开始（或已完成、失败）的阶段名集合
+    """
+    return [name for name, stage in STAGES.items()
+            if name not in started and all(dep in done for dep in stage.deps)]
+
+def estimate_song_memory(info):
+    """
+    根据文件头元数据估计一首歌处理期间的峰值内存（不解码）
+
+    参数:
+        info: audio_source.AudioInfo
+
+    返回:
+        估计的峰值内存（字节）：解码缓冲 + 共享内存副本 + 并行执行的第一批阶段
+    """
+    decode = info.frames * (info.channels + 2) * np.dtype(precision.real_dtype()).itemsize
+    stages = sum(STAGE_MEMORY[stage][0] + STAGE_MEMORY[stage][1] * info.duration for stage in ROOT_STAGES)
+    return int(decode + stages)
+
+
+class MemoryBudget:
+    def __init__(self, budget=None):
+        """
+        内存预算：按估计值准入新歌曲，并根据进程树的实际内存修正估计
+
+        参数:
+            budget: 预算（字节），None 表示启动时可用内存的 MEMORY_BUDGET_FRACTION
+        """
+        memory = psutil.virtual_memory()
+        self.budget = budget or int(memory.available * MEMORY_BUDGET_FRACTION)
+        self.reserve = int(memory.total * MEMORY_RESERVE_FRACTION)
+        self.scale = 1.0            # 实测/估计 的修正系数
+        self.reserved = 0           # 正在处理的歌曲的估计总和（未修正）
+        self._peak_ratio = 0.0
+        self._process = psutil.Process(os.getpid())
+        self._base_rss = self._process.memory_info().rss
+
+    def admit(self, estimate, busy):
+        """
+        判断能否开始一首估计峰值为 estimate 的歌曲
+
+        参数:
+            estimate: estimate_song_memory 的结果
+            busy: 当前是否有歌曲在处理（空闲时总是准入，避免单首超预算的歌曲永远无法开始）
+        """
+        if not busy:
+            return True
+        scaled = estimate * self.scale
+        if (self.reserved + estimate) * self.scale > self.budget:
+            return False
+        return psutil.virtual_memory().available - scaled >= self.reserve
+
+    def acquire(self, estimate):
+        self.reserved += estimate
+
+    def release(self, estimate):
+        """一首歌结束：用期间观测到的峰值比例更新修正系数"""
+        self.reserved -= estimate
+        if self._peak_ratio > 0:
+            self.scale = min(max(0.7 * self.scale + 0.3 * self._peak_ratio, 0.5), 4.0)
+        self._peak_ratio = 0.0
+
+    def observe(self):
+        """采样主进程和工作进程的实际内存，实测超过估计时立即调大修正系数"""
+        if self.reserved <= 0:
+            return
+        try:
+            children = self._process.children(recursive=True)
+            rss = self._process.memory_info().rss - self._base_rss
+            for child in children:
+                rss += child.memory_info().rss - WORKER_BASE_MEMORY
+        except psutil.Error:
+            return  # 进程刚好退出
+        ratio = max(rss, 0) / self.reserved
+        self._peak_ratio = max(self._peak_ratio, ratio)
+        if ratio > self.scale:
+            self.scale = min(ratio, 4.0)
+
+
+# 工作进程的全局变量，在初始化函数中设置
+_pause_event = None
+_stop_event = None
+
+
+def _init_worker(pause_event, stop_event):
+    """初始化工作进程的暂停/停止标志"""
+    global _pause_event, _stop_event
+    _pause_event = pause_event
+    _stop_event = stop_event
+    cancellation.set_token(cancellation.CancelToken(stop_event, pause_event))
+    # 进程数已占满核心，原生库不再各自开线程池；FFT线程数按提交时分配（chunk_workers）
+    thread_budget.limit_native_threads(1)
+
+
+def run_stage(stage, song, options):
+    """
+    在工作进程中执行一个阶段
+
+    参数:
+        stage: STAGES 中的阶段名
+        song: 共享内存描述和元数据（SharedSong 的可pickle部分）
+        options: 阶段选项（renderer、chunk_workers、precision 等）
+
+    返回:
+        (是否执行完成, 阶段输出的日志文本, 本阶段的缓存统计)
+    """
+    while _pause_event.is_set() and not _stop_event.is_set():
+        time.sleep(0.2)
+    if _stop_event.is_set():
+        return False, "", {}
+
+    cache = analysis_cache.configure(*options['cache'])
+    stats_before = dict(cache.stats)
+    spectral_engine.set_workers(options.get('chunk_workers', 1))
+    precision.set_precision(options.get('precision', precision.DEFAULT_PRECISION))
+
+    output = io.StringIO()
+    source, segments = _attach_source(song, STAGES[stage].needs_energy)
+    executed = True
+    try:
+        with contextlib.redirect_stdout(output):
+            STAGES[stage].func(source, song, options)
+    except cancellation.Cancelled:
+        executed = False
+    finally:
+        # 先释放所有指向共享内存的数组，再关闭映射
+        del source
+        for shm in segments:
+            try:
+                shm.close()
+            except BufferError:
+                pass  # 仍有数组引用时交给垃圾回收
+    stats = {name: cache.stats[name] - stats_before[name] for name in cache.stats}
+    return executed, output.getvalue(), stats
+
+
+class AnalysisPool:
+    def __init__(self, max_workers, renderer="matplotlib", log=print, memory_budget=None,
+                 cache_dir=analysis_cache.CACHE_DIR, cache_max_bytes=analysis_cache.CACHE_MAX_BYTES,
+                 precision_name=precision.DEFAULT_PRECISION, export_csv=False):
+        """
+        进程池分析后端
+
+        参数:
+            max_workers: 工作进程数（同时处理的歌曲数还受内存预算限制）
+            renderer: 频谱图渲染方式
+            log: 日志输出函数（接收一行文本）
+            memory_budget: 内存预算（字节），None 表示可用内存的 MEMORY_BUDGET_FRACTION
+            cache_dir, cache_max_bytes: 分析缓存的目录和容量上限（0 禁用）
+            precision_name: 计算精度，'float64' 或 'float32'（见 precision）
+            export_csv: 频谱图阶段是否额外导出旧格式的 data.csv
+        """
+        self.max_workers = max_workers
+        self.options = {'renderer': renderer, 'cache': (cache_dir, cache_max_bytes)}
+        if precision_name != precision.DEFAULT_PRECISION:
+            self.options['precision'] = precision_name
+        if export_csv:
+            self.options['export_csv'] = True
+        self.log = log
+        self.memory_budget = memory_budget
+        self._pause_event = mp.Event()
+        self._stop_event = mp.Event()
+
+    def pause(self):
+        """暂停：正在执行的阶段在下一个计算分块前等待，不再提交新阶段（就绪阶段留在主进程的队列中）"""
+        self._pause_event.set()
+
+    def resume(self):
+        """继续处理"""
+        self._pause_event.clear()
+
+    def stop(self):
+        """停止：正在执行的阶段在下一个计算分块前中止（保存检查点），不再开始新的阶段"""
+        self._stop_event.set()
+
+    @property
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def run(self, names, directory='music_stft', on_song_start=None, on_stage_done=None, on_song_done=None,
+            on_progress=None, output_dir='data_stft', total=None):
+        """
+        处理一组音乐文件（输出目录中清单记录为最新的阶段会被跳过）
+
+        参数:
+            names: 文件名列表（位于 directory 下），或逐个送入文件名的 queue.Queue（None 表示结束，
+                   如 ingest.IngestPipeline 的输出；只在有处理能力时取出，队列满时生产者等待）
+            directory: 音乐文件目录
+            on_song_start: on_song_start(name)，解码前调用
+            on_stage_done: on_stage_done(name, finished_message)，每个阶段完成后调用
+            on_song_done: on_song_done(name, ok)，一首歌的所有阶段结束后调用
+            on_progress: on_progress(finished_stages, total_stages)，阶段级进度
+            output_dir: 输出根目录（每首歌的清单在 output_dir/<歌名>/ 下）
+            total: 文件总数（用于进度；names 为队列时给出，默认按已收到的文件数计算）
+
+        返回:
+            成功处理的文件数
+        """
+        self._stop_event.clear()
+        source_queue = names if isinstance(names, queue.Queue) else None
+        pending_names = [] if source_queue else list(names)
+        source_done = source_queue is None
+        decoding = {}       # future -> name
+        songs = {}          # name -> SharedSong（已解码、尚未结束）
+        done = {}           # name -> 已成功完成的阶段
+        started = {}        # name -> 已开始（含完成、失败）的阶段
+        ready = []          # 就绪队列 [(name, stage)]，先解码的歌曲优先
+        in_flight = {}      # future -> (name, stage)
+        estimates = {}      # name -> 估计的峰值内存
+        manifests = {}      # name -> (StageManifest, 需要执行的阶段)
+        budget = MemoryBudget(self.memory_budget)
+        waiting_logged = None
+        cache = analysis_cache.configure(*self.options['cache'])  # 主进程解码时使用
+        precision.set_precision(self.options.get('precision', precision.DEFAULT_PRECISION))
+        # 本机调优选出的非默认FFT实现（舍入不同）记入清单，换实现后重做
+        self.options.pop('fft_plans', None)
+        if fft_tuner.plan_signature():
+            self.options['fft_plans'] = fft_tuner.plan_signature()
+        cache_stats = dict.fromkeys(cache.stats, 0)
+        parent_stats = dict(cache.stats)
+        finished = 0
+        total_songs = total if total is not None else len(pending_names)
+        finished_stages = 0
+        self.log(f"内存预算: {budget.budget / MB / 1024:.1f} GB\n")
+
+        def duration(name):
+            try:
+                return get_audio_info(f"{directory}/{name}").duration
+            except Exception:
+                return 0
+
+        def chunk_workers():
+            """
+            提交阶段时分给它的FFT线程数：还有排队的阶段或歌曲时每个阶段一个核，
+            批次末尾把空闲进程的核平分给正在执行的阶段，长歌曲不再拖慢整批
+            """
+            if ready or pending_names or decoding or not source_done:
+                return 1
+            return max(1, self.max_workers // (len(in_flight) + 1))
+
+        # 最长的歌曲最先开始（LPT），减少批次末尾只剩一首长歌在跑的时间
+        pending_names.sort(key=duration, reverse=True)
+
+        def estimate(name):
+            try:
+                return estimate_song_memory(get_audio_info(f"{directory}/{name}"))
+            except Exception:
+                return 0  # 读不到文件头时按0估计，错误留给解码阶段报告
+
+        def plan(name):
+            """读取清单，确定需要执行的阶段"""
+            folder = f"{output_dir}/{name.rsplit('.', 1)[0]}"
+            manifest = StageManifest(folder)
+            try:
+                manifest.set_input(file_fingerprint(f"{directory}/{name}", manifest.input))
+            except OSError:
+                return None, set(STAGES)  # 文件读不到，错误留给解码阶段报告
+            return manifest, stale_stages(manifest, self.options)
+
+        def progress(count):
+            nonlocal finished_stages
+            finished_stages += count
+            if count and on_progress:
+                on_progress(finished_stages, total_songs * len(STAGES))
+
+        def song_args(song):
+            return {'path': song.path, 'sr': song.sr, 'channels': song.channels, 'content_hash': song.content_hash,
+                    'audio': song.audio, 'energy': song.energy}
+
+        def schedule(name):
+            """把新就绪的阶段放入队列；没有可执行和正在执行的阶段时结束这首歌"""
+            for stage in ready_stages(done[name], started[name]):
+                started[name].add(stage)
+                ready.append((name, stage))
+            busy = any(n == name for n, _ in ready) or any(n == name for n, _ in in_flight.values())
+            if not busy:
+                finish(name)
+
+        def song_done(name, ok):
+            # 回调出错（如移动文件失败）只影响这首歌，不中断整批处理
+            if on_song_done:
+                try:
+                    on_song_done(name, ok)
+                except Exception as e:
+                    self.log(f"Error finishing {name}: {str(e)}\n")
+
+        def finish(name):
+            nonlocal finished
+            songs.pop(name).release()
+            budget.release(estimates.pop(name))
+            ok = len(done[name]) == len(STAGES)
+            finished += ok
+            song_done(name, ok)
+            # 依赖失败而未执行的阶段也计入进度
+            progress(len(STAGES) - len(started[name]))
+
+        ctx = mp.get_context()
+        with ProcessPoolExecutor(max_workers=self.max_workers, mp_context=ctx, initializer=_init_worker,
+                                 initargs=(self._pause_event, self._stop_event)) as pool, \
+                ThreadPoolExecutor(max_workers=2) as decoder:
+            try:
+                while (pending_names or not source_done or decoding or songs) and not self.stopped:
+                    budget.observe()
+                    paused = self._pause_event.is_set()
+                    # 从导入队列取下一个已准备好的文件（只在有处理能力时取，保持背压）
+                    if (not source_done and not pending_names and not paused
+                            and len(songs) + len(decoding) < self.max_workers):
+                        try:
+                            name = source_queue.get_nowait()
+                        except queue.Empty:
+                            name = False
+                        if name is None:
+                            source_done = True
+                        elif name:
+                            pending_names.append(name)
+                            if total is None:
+                                total_songs += 1
+                    # 同时在处理的歌曲数不超过进程数，且估计的峰值内存总和不超过预算
+                    while pending_names and len(songs) + len(decoding) < self.max_workers and not paused:
+                        name = pending_names[0]
+                        if name not in manifests:
+                            manifests[name] = plan(name)
+                        if not manifests[name][1]:
+                            # 所有阶段都是最新的，不需要解码
+                            pending_names.pop(0)
+                            self.log(f"{name}: 所有阶段都是最新的，跳过\n")
+                            finished += 1
+                            song_done(name, True)
+                            progress(len(STAGES))
+                            continue
+                        if name not in estimates:
+                            estimates[name] = estimate(name)
+                        if not budget.admit(estimates[name], busy=bool(songs or decoding)):
+                            if waiting_logged != name:
+                                self.log(f"等待内存: {name} 估计需要 "
+                                         f"{estimates[name] * budget.scale / MB:.0f} MB\n")
+                                waiting_logged = name
+                            break
+                        pending_names.pop(0)
+                        budget.acquire(estimates[name])
+                        if on_song_start:
+                            on_song_start(name)
+                        decoding[decoder.submit(AudioSource.load, f"{directory}/{name}")] = name
+
+                    # 就绪阶段只在有空闲进程时提交，暂停时留在队列中
+                    while ready and len(in_flight) < self.max_workers and not paused:
+                        name, stage = ready.pop(0)
+                        self.log(f'Processing {name}: {STAGES[stage].label}\n')
+                        options = dict(self.options, chunk_workers=chunk_workers())
+                        future = pool.submit(run_stage, stage, song_args(songs[name]), options)
+                        in_flight[future] = (name, stage)
+
+                    if not decoding and not in_flight:
+                        time.sleep(0.2)  # 暂停中或等待导入
+                        continue
+                    completed, _ = wait(list(decoding) + list(in_flight), timeout=0.5,
+                                        return_when=FIRST_COMPLETED)
+                    for future in completed:
+                        if future in decoding:
+                            name = decoding.pop(future)
+                            try:
+                                songs[name] = SharedSong(name, future.result())
+                            except Exception as e:
+                                self.log(f"Error processing {name}: {str(e)}\n")
+                                budget.release(estimates.pop(name))
+                                song_done(name, False)
+                                progress(len(STAGES))
+                                continue
+                            # 清单中已是最新的阶段视为已完成
+                            skipped = set(STAGES) - manifests[name][1]
+                            if skipped:
+                                self.log(f"{name}: 跳过无需重做的阶段 {', '.join(sorted(skipped))}\n")
+                            done[name], started[name] = set(skipped), set(skipped)
+                            progress(len(skipped))
+                            schedule(name)
+                            continue
+
+                        name, stage = in_flight.pop(future)
+                        try:
+                            executed, output, stats = future.result()
+                            for key, value in stats.items():
+                                cache_stats[key] += value
+                            for line in output.splitlines(keepends=True):
+                                self.log(line)
+                            if executed:
+                                done[name].add(stage)
+                                manifest = manifests[name][0]
+                                if manifest is not None and STAGES[stage].outputs is not None:
+                                    manifest.record(stage, STAGES[stage].run_params(self.options))
+                                if on_stage_done:
+                                    on_stage_done(name, STAGES[stage].done_message)
+                        except Exception as e:
+                            # 依赖这个阶段的后续阶段不再执行
+                            self.log(f"Error processing {name}: {str(e)}\n")
+                        progress(1)
+                        schedule(name)
+            finally:
+                # 停止或出错时，等正在执行的阶段结束后再释放共享内存
+                if songs:
+                    pool.shutdown(wait=True, cancel_futures=True)
+                    for song in songs.values():
+                        song.release()
+        if cache.enabled:
+            for key in cache_stats:
+                cache_stats[key] += cache.stats[key] - parent_stats[key]
+            self.log(cache.summary(cache_stats) + "\n")
+        return finished
@@ -1,8 +1,7 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 import os
-import soundfile as sf
-import librosa
+from audio_source import get_audio_info
 import datetime
 import threading
 import queue
@@ -15,7 +14,7 @@ class AudioClipApp:
     def __init__(self, root):
         self.root = root
         self.root.title("音频截取与STFT分析")
-        self.root.geometry("600x500")
+        self.root.geometry("600x600")
 
         # 创建主框架
         main_frame = ttk.Frame(root, padding="10")
@@ -53,21 +52,33 @@ class AudioClipApp:
         end_time_entry = ttk.Entry(main_frame, textvariable=self.end_time_var, width=20)
         end_time_entry.grid(row=3, column=1, sticky=tk.W, pady=5, padx=(10, 0))
 
+        # 批量时间段（每行 "开始,结束"，填写后忽略上面的单个时间段）
+        ttk.Label(main_frame, text="批量时间段:").grid(row=4, column=0, sticky=(tk.W, tk.N), pady=5)
+        self.ranges_text = tk.Text(main_frame, height=4, width=20)
+        self.ranges_text.grid(row=4, column=1, sticky=(tk.W, tk.E), pady=5, padx=(10, 0))
+        self.csv_button = ttk.Button(main_frame, text="从CSV批量处理", command=self.start_csv_processing)
+        self.csv_button.grid(row=4, column=2, sticky=tk.N, padx=(10, 0), pady=5)
+
         # 处理按钮
         self.process_button = ttk.Button(main_frame, text="开始处理", command=self.start_processing, state="disabled")
-        self.process_button.grid(row=4, column=1, pady=20, sticky=tk.W, padx=(10, 0))
+        self.process_button.grid(row=5, column=1, pady=20, sticky=tk.W, padx=(10, 0))
+
+        # 是否另存截取的音频（分析直接使用内存中的片段，不需要WAV文件）
+        self.save_clip_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(main_frame, text="保存截取的音频", variable=self.save_clip_var).grid(
+            row=5, column=1, pady=20, sticky=tk.E)
 
         # 进度条
-        ttk.Label(main_frame, text="处理进度:").grid(row=5, column=0, sticky=tk.W, pady=5)
+        ttk.Label(main_frame, text="处理进度:").grid(row=6, column=0, sticky=tk.W, pady=5)
         self.progress = ttk.Progressbar(main_frame, mode='indeterminate')
-        self.progress.grid(row=5, column=1, sticky=(tk.W, tk.E), pady=5, padx=(10, 0))
+        self.progress.grid(row=6, column=1, sticky=(tk.W, tk.E), pady=5, padx=(10, 0))
 
         # 日志显示区域
-        ttk.Label(main_frame, text="处理日志:").grid(row=6, column=0, sticky=(tk.W, tk.N), pady=(20, 5))
+        ttk.Label(main_frame, text="处理日志:").grid(row=7, column=0, sticky=(tk.W, tk.N), pady=(20, 5))
 
         # 创建日志文本框和滚动条
         log_frame = ttk.Frame(main_frame)
-        log_frame.grid(row=6, column=1, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(20, 0), padx=(10, 0))
+        log_frame.grid(row=7, column=1, columnspan=2, sticky=(tk.W, tk.E, tk.N, tk.S), pady=(20, 0), padx=(10, 0))
         log_frame.columnconfigure(0, weight=1)
         log_frame.rowconfigure(0, weight=1)
 
@@ -79,7 +90,7 @@ class AudioClipApp:
         scrollbar.grid(row=0, column=1, sticky=(tk.N, tk.S))
 
         # 配置主框架的行权重，使日志区域可以扩展
-        main_frame.rowconfigure(6, weight=1)
+        main_frame.rowconfigure(7, weight=1)
 
         # 初始化
         self.audio_duration = 0
@@ -109,8 +120,8 @@ class AudioClipApp:
         if selected_file:
             file_path = os.path.join("music_stft", selected_file)
             try:
-                # 获取音频时长
-                self.audio_duration = librosa.get_duration(path=file_path)
+                # 获取音频时长（只读文件头）
+                self.audio_duration = get_audio_info(file_path).duration
                 self.duration_label.config(text=f"{self.audio_duration:.2f} 秒")
 
                 # 设置默认结束时间为音频总时长
@@ -121,11 +132,26 @@ class AudioClipApp:
 
                 self.log_message(f"选择文件: {selected_file} (时长: {self.audio_duration:.2f}秒)")
 
+                # 后台预先计算整首歌的频谱（就绪后截取只需切片，就绪前按片段单独计算）
+                stft_unified_time.release_song_spectrum()
+                threading.Thread(target=self.prepare_spectrum, args=(file_path,), daemon=True).start()
+
             except Exception as e:
                 self.log_message(f"读取音频文件失败: {str(e)}")
                 self.duration_label.config(text="读取失败")
                 self.process_button.config(state="disabled")
 
+    def prepare_spectrum(self, file_path):
+        """在后台线程中计算（或从缓存读取）整首歌的频谱；歌曲太长时不计算，截取时只读取所需片段"""
+        try:
+            self.log_message("正在准备整首歌的频谱...")
+            if stft_unified_time.get_song_spectrum(file_path) is None:
+                self.log_message("音频较长，不保留整首歌的频谱，截取时按片段计算")
+            else:
+                self.log_message("频谱已就绪，截取时间段将直接切片")
+        except Exception as e:
+            self.log_message(f"计算频谱失败: {str(e)}")
+
     def validate_time_inputs(self):
         """验证时间输入"""
         try:
@@ -171,68 +197,75 @@ class AudioClipApp:
 
     def start_processing(self):
         """开始处理按钮点击事件"""
-        validation_result = self.validate_time_inputs()
-        if not validation_result:
+        ranges_text = self.ranges_text.get("1.0", tk.END).strip()
+        if ranges_text:
+            # 批量时间段
+            try:
+                ranges = stft_unified_time.parse_time_ranges(ranges_text)
+            except ValueError as e:
+                messagebox.showerror("错误", str(e))
+                return
+        else:
+            validation_result = self.validate_time_inputs()
+            if not validation_result:
+                return
+            _, start_time, end_time = validation_result
+            ranges = [(start_time, end_time)]
+
+        input_path = os.path.join("music_stft", self.audio_var.get())
+        self._start_thread({input_path: ranges})
+
+    def start_csv_processing(self):
+        """从CSV读取多首歌的时间段并批量处理"""
+        csv_path = filedialog.askopenfilename(title="选择时间段CSV", filetypes=[("CSV", "*.csv"), ("所有文件", "*.*")])
+        if not csv_path:
             return
+        selected_file = self.audio_var.get()
+        default_file = os.path.join("music_stft", selected_file) if selected_file else None
+        try:
+            jobs = stft_unified_time.load_ranges_csv(csv_path, default_file)
+        except (OSError, ValueError) as e:
+            messagebox.showerror("错误", f"读取CSV失败: {str(e)}")
+            return
+        self.log_message(f"已读取 {csv_path}: {len(jobs)} 首歌, {sum(len(r) for r in jobs.values())} 个时间段")
+        self._start_thread(jobs)
 
-        _, start_time, end_time = validation_result
-
-        # 禁用处理按钮，开始进度条
+    def _start_thread(self, jobs):
+        """禁用按钮并在后台线程中处理"""
         self.process_button.config(state="disabled")
+        self.csv_button.config(state="disabled")
         self.progress.start()
 
-        # 在新线程中执行处理
         processing_thread = threading.Thread(
             target=self.process_audio,
-            args=(start_time, end_time),
+            args=(jobs, self.save_clip_var.get()),
             daemon=True
         )
         processing_thread.start()
 
-    def process_audio(self, start_time, end_time):
-        """在后台线程中处理音频"""
-        try:
-            selected_file = self.audio_var.get()
-            input_path = os.path.join("music_stft", selected_file)
-
-            # 创建输出目录名称
-            base_name = os.path.splitext(selected_file)[0]
-            time_range = f"{start_time:.1f}-{end_time:.1f}s"
-            output_dir_name = f"{base_name}-{time_range}"
-            output_dir = os.path.join("data_stft_time", output_dir_name)
-
-            # 创建输出目录
-            os.makedirs(output_dir, exist_ok=True)
-
-            self.log_message(f"开始处理: {selected_file}")
-            self.log_message(f"时间范围: {start_time:.1f}s - {end_time:.1f}s")
-            self.log_message(f"输出目录: {output_dir}")
-
-            # 读取并截取音频
-            self.log_message("正在读取音频文件...")
-            audio, sr = sf.read(input_path)
+    def process_audio(self, jobs, save_clip=False):
+        """
+        在后台线程中处理音频：整首歌的频谱已就绪时从中切片，否则每段只读取该段做STFT，并行写出
 
-            # 转换时间到样本索引
-            start_sample = int(start_time * sr)
-            end_sample = int(end_time * sr)
-
-            # 截取音频
-            if audio.ndim > 1:
-                clipped_audio = audio[start_sample:end_sample, :]
-            else:
-                clipped_audio = audio[start_sample:end_sample]
-
-            # 保存截取的音频
-            clipped_audio_path = os.path.join(output_dir, f"clipped_{base_name}_{time_range}.wav")
-            sf.write(clipped_audio_path, clipped_audio, sr)
-            self.log_message(f"已保存截取音频: {clipped_audio_path}")
-
-            # 调用STFT处理
-            self.log_message("开始STFT分析...")
-            stft_unified_time.main(clipped_audio_path, output_dir)
+        参数:
+            jobs: {音频文件路径: [(开始, 结束), ...]}
+            save_clip: 是否保存截取的音频
+        """
+        try:
+            total = sum(len(ranges) for ranges in jobs.values())
+            self.log_message(f"开始处理: {len(jobs)} 首歌, {total} 个时间段")
+            # 只有一个时间段时保持原来的 matplotlib 图像；多个时间段用线程安全的直接渲染并行写出
+            renderer = "matplotlib" if total == 1 else "raster"
+            results = stft_unified_time.generate_clip_batch(jobs, renderer=renderer, save_clip=save_clip,
+                                                            log=self.log_message)
+            failed = [r for r in results if r[4]]
 
             self.log_message("处理完成!")
-            messagebox.showinfo("完成", f"音频处理完成!\n输出目录: {output_dir}")
+            if total == 1 and not failed:
+                messagebox.showinfo("完成", f"音频处理完成!\n输出目录: {results[0][3]}")
+            else:
+                messagebox.showinfo("完成", f"批量处理完成: 成功 {total - len(failed)} 个, 失败 {len(failed)} 个\n"
+                                          f"输出目录: data_stft_time")
 
         except Exception as e:
             error_msg = f"处理过程中发生错误: {str(e)}"
@@ -246,7 +279,9 @@ class AudioClipApp:
     def _reset_ui(self):
         """重置UI状态"""
         self.progress.stop()
-        self.process_button.config(state="normal")
+        self.csv_button.config(state="normal")
+        if self.audio_var.get():
+            self.process_button.config(state="normal")
 
 def main():
     root = tk.Tk()
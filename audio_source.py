@@ -0,0 +1,369 @@
+# 单次解码的音频源 - 每首歌只解码一次，解码结果在所有分析阶段之间共享
+import os
+import json
+import hashlib
+import contextlib
+import threading
+import subprocess
+import numpy as np
+import soundfile as sf
+import ffmpeg
+import analysis_cache
+import ncm_decrypt
+import precision
+
+# 文件头元数据缓存: (绝对路径, 文件大小, 修改时间) -> AudioInfo
+_info_cache = {}
+_info_lock = threading.Lock()
+# 内容哈希缓存: (绝对路径, 文件大小, 修改时间) -> sha256
+_hash_cache = {}
+HASH_CHUNK = 1024 * 1024
+PIPE_CHUNK_FRAMES = 1 << 16  # ffmpeg 管道每次读取的帧数
+
+
+class AudioInfo:
+    def __init__(self, sr, channels, frames):
+        """
+        音频元数据（不含采样数据）
+
+        参数:
+            sr: 采样率
+            channels: 声道数
+            frames: 每声道采样点数
+        """
+        self.sr = sr
+        self.channels = channels
+        self.frames = frames
+
+    @property
+    def duration(self):
+        """播放时长（秒）"""
+        return self.frames / self.sr
+
+
+class AudioSource:
+    def __init__(self, path, samples, sr, channels=1, content_hash=None):
+        """
+        已解码的单声道音频
+
+        参数:
+            path: 原始音频文件路径（用于生成输出目录名）
+            samples: 单声道浮点采样缓冲
+            sr: 采样率
+            channels: 原始文件的声道数
+            content_hash: 原始文件内容的sha256（分析缓存的键），None 表示不使用缓存
+        """
+        self.path = path
+        self.samples = samples
+        self.sr = sr
+        self.channels = channels
+        self.content_hash = content_hash
+        self.derived = {}                   # 各阶段共享的中间结果
+        self._derived_lock = threading.RLock()
+
+    @classmethod
+    def load(cls, path):
+        """读取并解码音频文件为单声道浮点缓冲（当前精度，见 precision；压缩格式的解码结果会放入分析缓存）"""
+        print(f"加载音频文件: {path}")
+        cache = analysis_cache.get_cache()
+        digest = content_hash(path) if cache.enabled else None
+        dtype = precision.real_dtype()
+        # WAV直接读取和读缓存一样快，只缓存需要解码的格式
+        use_pcm_cache = digest is not None and not path.lower().endswith('.wav')
+        if use_pcm_cache:
+            key = cache.key(digest, 'pcm', {} if dtype == np.float64 else {'dtype': precision.get_precision()})
+            hit = cache.get(key)
+            if hit is not None:
+                return cls(path, hit['samples'], int(hit['sr']), int(hit['channels']), digest)
+
+        try:
+            audio, sr = _read_soundfile(path, dtype)
+            channels = 1 if audio.ndim == 1 else audio.shape[1]
+            if audio.ndim > 1:
+                audio = audio.mean(axis=1, dtype=dtype)  # 转为单声道
+        except RuntimeError:
+            # soundfile 无法识别的格式（mp3/m4a/wma...）直接从 ffmpeg 管道解码，不写中间WAV
+            try:
+                audio, sr, channels = decode_ffmpeg(path, dtype=dtype)
+            except (OSError, ffmpeg.Error) as e:
+                if ncm_decrypt.is_ncm(path):
+                    raise  # librosa 只能打开文件路径，无法读取加密的NCM
+                # 没有 ffmpeg 可执行文件时交给 librosa（保持原始采样率）
+                print(f"ffmpeg 解码失败，改用 librosa: {str(e)}")
+                import librosa  # 只在回退时导入（导入较慢）
+                audio, sr = librosa.load(path, sr=None, mono=True)
+                channels = get_audio_info(path).channels
+        audio = np.ascontiguousarray(audio, dtype=dtype)
+        if use_pcm_cache:
+            cache.put(key, samples=audio, sr=sr, channels=channels)
+        return cls(path, audio, sr, channels, digest)
+
+    def cached(self, key, compute):
+        """
+        取出（或首次计算并保存）与这首歌绑定的中间结果
+
+        参数:
+            key: 结果的键（包含影响结果的参数）
+            compute: 无参函数，缓存未命中时调用
+        """
+        with self._derived_lock:
+            if key not in self.derived:
+                self.derived[key] = compute()
+            return self.derived[key]
+
+    @property
+    def name(self):
+        """不带扩展名的文件名"""
+        return os.path.basename(self.path).rsplit('.', 1)[0]
+
+    @property
+    def frames(self):
+        """采样点数"""
+        return len(self.samples)
+
+    @property
+    def duration(self):
+        """播放时长（秒）"""
+        return self.frames / self.sr
+
+
+def _read_soundfile(path, dtype=np.float64):
+    """用 soundfile 读取整个文件（直接解码为 dtype）；NCM 文件边读边解密，不写出解密后的文件"""
+    if ncm_decrypt.is_ncm(path):
+        with ncm_decrypt.open_audio(path) as f:
+            return sf.read(f, dtype=dtype)
+    return sf.read(path, dtype=dtype)
+
+
+def _probe_header(path):
+    """只读取文件头获取元数据：优先 soundfile，不支持的格式用 ffprobe"""
+    try:
+        if ncm_decrypt.is_ncm(path):
+            with ncm_decrypt.open_audio(path) as f:
+                info = sf.info(f)
+        else:
+            info = sf.info(path)
+        return AudioInfo(info.samplerate, info.channels, info.frames)
+    except RuntimeError:
+        pass
+
+    if ncm_decrypt.is_ncm(path):
+        ncm = ncm_decrypt.NcmFile(path)
+        probe = _probe_ncm(ncm)
+    else:
+        probe = ffmpeg.probe(path)
+    stream = next(s for s in probe['streams'] if s.get('codec_type') == 'audio')
+    sr = int(stream['sample_rate'])
+    duration = stream.get('duration') or probe['format'].get('duration')
+    if duration in (None, 'N/A') and ncm_decrypt.is_ncm(path):
+        # 从管道读取时 ffprobe 不知道总长度，按码率和音频字节数估计
+        duration = ncm.audio_size * 8 / float(stream.get('bit_rate') or probe['format']['bit_rate'])
+    return AudioInfo(sr, int(stream['channels']), int(round(float(duration) * sr)))
+
+
+def _feed_ncm(ncm, pipe):
+    """把解密后的音频写入子进程的标准输入（在独立线程中运行；对方提前结束读取时停止）"""
+    try:
+        for block in ncm.iter_audio():
+            pipe.write(block)
+    except (BrokenPipeError, OSError, ValueError):
+        pass
+    finally:
+        try:
+            pipe.close()
+        except OSError:
+            pass
+
+
+def _start_feeder(ncm, pipe):
+    thread = threading.Thread(target=_feed_ncm, args=(ncm, pipe), daemon=True)
+    thread.start()
+    return thread
+
+
+def _probe_ncm(ncm):
+    """ffprobe 从标准输入读取NCM中解密后的音频（不写出解密文件）"""
+    process = subprocess.Popen(['ffprobe', '-v', 'error', '-show_format', '-show_streams', '-of', 'json',
+                                '-f', ncm.format, '-i', 'pipe:'],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    feeder = _start_feeder(ncm, process.stdin)
+    out = process.stdout.read()
+    stderr = process.stderr.read()
+    feeder.join()
+    if process.wait() != 0:
+        raise ffmpeg.Error('ffprobe', out, stderr)
+    return json.loads(out.decode('utf-8'))
+
+
+def decode_ffmpeg(path, start_time=None, end_time=None, dtype=np.float64):
+    """
+    用 ffmpeg 子进程把音频解码为 float32 PCM，分块读取管道并直接混合为单声道缓冲
+    （不生成完整的多声道数组，也不写临时文件）
+
+    参数:
+        path: 音频文件路径
+        start_time: 开始时间（秒），None 表示从头开始（由 ffmpeg 在输入端定位，不解码之前的部分）
+        end_time: 结束时间（秒），None 表示到文件末尾
+        dtype: 输出采样的类型（float32 时不经过双精度缓冲）
+
+    返回:
+        samples: 单声道 dtype 采样
+        sr: 采样率（原始采样率，不重采样）
+        channels: 原始声道数
+    """
+    info = get_audio_info(path)
+    sr, channels = info.sr, info.channels
+    ncm = ncm_decrypt.NcmFile(path) if ncm_decrypt.is_ncm(path) else None
+    input_args = {}
+    frames_expected = info.frames
+    if start_time:
+        input_args['ss'] = start_time
+    if end_time is not None:
+        input_args['t'] = end_time - (start_time or 0)
+        frames_expected = int(input_args['t'] * sr)
+    if ncm is not None:
+        # NCM 边解密边从标准输入送给 ffmpeg（与 soundfile 的路径一样不写出解密后的文件）
+        stream = ffmpeg.input('pipe:', format=ncm.format, **input_args)
+        global_args = ('-loglevel', 'error')
+    else:
+        stream = ffmpeg.input(path, **input_args)
+        global_args = ('-nostdin', '-loglevel', 'error')  # stderr 只输出错误，避免管道写满阻塞
+    process = (
+        stream
+        .output('pipe:', format='f32le', acodec='pcm_f32le', ac=channels, ar=sr)
+        .global_args(*global_args)
+        .run_async(pipe_stdin=ncm is not None, pipe_stdout=True, pipe_stderr=True)
+    )
+    feeder = _start_feeder(ncm, process.stdin) if ncm is not None else None
+
+    # 按文件头估计的长度预分配，实际更长时扩容
+    samples = np.empty(max(frames_expected, 1), dtype=dtype)
+    frames = 0
+    frame_bytes = 4 * channels
+    pending = b''
+    try:
+        while True:
+            chunk = process.stdout.read(PIPE_CHUNK_FRAMES * frame_bytes)
+            if not chunk:
+                break
+            chunk = pending + chunk
+            usable = len(chunk) - len(chunk) % frame_bytes  # 不完整的帧留到下一块
+            pending = chunk[usable:]
+            block = np.frombuffer(chunk[:usable], dtype='<f4').reshape(-1, channels)
+            if frames + len(block) > len(samples):
+                samples = np.resize(samples, max(2 * len(samples), frames + len(block)))
+            samples[frames:frames + len(block)] = block.mean(axis=1, dtype=np.float64) if channels > 1 else block[:, 0]
+            frames += len(block)
+    except BaseException:
+        process.kill()
+        process.wait()
+        raise
+    finally:
+        if feeder is not None:
+            feeder.join()
+
+    stderr = process.stderr.read()
+    if process.wait() != 0:
+        raise ffmpeg.Error('ffmpeg', b'', stderr)
+    return samples[:frames].copy() if frames < len(samples) else samples, sr, channels
+
+
+def read_clip(path, start_time, end_time):
+    """
+    只读取 [start_time, end_time) 这一段：soundfile 支持的格式定位后读取所需的帧，
+    其他格式由 ffmpeg 在输入端定位解码（此时返回单声道）
+
+    参数:
+        path: 音频文件路径
+        start_time: 开始时间（秒）
+        end_time: 结束时间（秒），None 表示到文件末尾
+
+    返回:
+        audio: 采样，形状与 sf.read 相同（单声道为一维，多声道为 (帧, 声道)）
+        sr: 采样率
+    """
+    try:
+        # sf.SoundFile 不会关闭传入的文件对象，NCM 的解密读取器由 with 关闭
+        with (ncm_decrypt.open_audio(path) if ncm_decrypt.is_ncm(path) else contextlib.nullcontext(path)) as source:
+            with sf.SoundFile(source) as f:
+                sr = f.samplerate
+                start_sample = min(int(start_time * sr), f.frames)
+                end_sample = f.frames if end_time is None else min(int(end_time * sr), f.frames)
+                f.seek(start_sample)
+                return f.read(end_sample - start_sample), sr
+    except RuntimeError:
+        audio, sr, _ = decode_ffmpeg(path, start_time, end_time)
+        return audio, sr
+
+
+def content_hash(path):
+    """
+    文件内容的sha256，按文件路径、大小和修改时间缓存
+
+    参数:
+        path: 文件路径
+    """
+    stat = os.stat(path)
+    key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    with _info_lock:
+        digest = _hash_cache.get(key)
+    if digest is None:
+        sha = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+                sha.update(chunk)
+        digest = sha.hexdigest()
+        with _info_lock:
+            _hash_cache[key] = digest
+    return digest
+
+
+def get_audio_info(audio):
+    """
+    获取音频的时长、采样率、声道数和采样点数，不解码整个文件
+
+    参数:
+        audio: 音频文件路径，或已解码的AudioSource（直接从缓冲计算）
+
+    返回:
+        AudioInfo，按文件路径、大小和修改时间缓存
+    """
+    if isinstance(audio, AudioSource):
+        return AudioInfo(audio.sr, audio.channels, audio.frames)
+
+    stat = os.stat(audio)
+    key = (os.path.abspath(audio), stat.st_size, stat.st_mtime_ns)
+    with _info_lock:
+        info = _info_cache.get(key)
+    if info is None:
+        info = _probe_header(audio)
+        with _info_lock:
+            _info_cache[key] = info
+    return info
+
+
+def as_audio_source(audio, sr=None):
+    """
+    接受 AudioSource、文件路径或采样数组，统一返回 AudioSource（路径会被解码一次）
+
+    参数:
+        audio: AudioSource、文件路径，或 sf.read 形式的采样数组（多声道时混合为单声道）
+        sr: 采样率（audio 为数组时必须给出）
+    """
+    if isinstance(audio, AudioSource):
+        return audio
+    if isinstance(audio, np.ndarray):
+        if sr is None:
+            raise ValueError("传入采样数组时必须指定采样率")
+        channels = 1 if audio.ndim == 1 else audio.shape[1]
+        if audio.ndim > 1:
+            audio = audio.mean(axis=1)
+        return AudioSource(None, np.ascontiguousarray(audio), sr, channels)
+    return AudioSource.load(audio)
+
+
+def audio_path(audio):
+    """接受 AudioSource 或文件路径，返回文件路径"""
+    if isinstance(audio, AudioSource):
+        return audio.path
+    return audio
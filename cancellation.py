@@ -0,0 +1,64 @@
+# 协作式暂停/停止 - 长时间的计算在分块之间调用 check()：
+# 暂停时在原地等待（已算好的中间结果都还在内存里），停止时抛出 Cancelled
+# 工作线程共用进程内的当前令牌；进程池的工作进程用主进程传入的 multiprocessing.Event 创建令牌
+import threading
+import time
+
+POLL_INTERVAL = 0.1  # 暂停时检查继续/停止的间隔（秒）
+
+
+class Cancelled(Exception):
+    """处理被用户停止"""
+
+
+class CancelToken:
+    def __init__(self, stop_event=None, pause_event=None):
+        """
+        取消令牌
+
+        参数:
+            stop_event: 停止标志（threading.Event 或 multiprocessing.Event），None 时新建
+            pause_event: 暂停标志，None 时新建
+        """
+        self.stop_event = stop_event if stop_event is not None else threading.Event()
+        self.pause_event = pause_event if pause_event is not None else threading.Event()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def pause(self):
+        self.pause_event.set()
+
+    def resume(self):
+        self.pause_event.clear()
+
+    @property
+    def stopped(self):
+        return self.stop_event.is_set()
+
+    def check(self):
+        """暂停时等待继续；已停止时抛出 Cancelled"""
+        while self.pause_event.is_set() and not self.stop_event.is_set():
+            time.sleep(POLL_INTERVAL)
+        if self.stop_event.is_set():
+            raise Cancelled()
+
+
+_token = CancelToken()
+
+
+def set_token(token):
+    """设置进程内的当前令牌（开始新一轮处理时换成新令牌）"""
+    global _token
+    _token = token
+    return token
+
+
+def get_token():
+    """进程内的当前令牌"""
+    return _token
+
+
+def check():
+    """检查当前令牌（在计算的分块之间调用）"""
+    _token.check()
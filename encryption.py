@@ -1,33 +1,59 @@
 import os
 import subprocess
 import glob
+import ncm_decrypt
 
 def path()-> str:
     """返回当前脚本的路径"""
     return os.path.dirname(os.path.abspath(__file__))
 
 
+# 需要解密的加密格式
+ENCRYPTED_EXTENSIONS = ['ncm', 'kgm', 'kwm']
+exe_path = r'um.exe'
+
+
+def decrypt_file(input_path):
+    """
+    解密单个加密音频文件（成功后删除原文件）
+
+    参数:
+        input_path: 加密文件路径
+
+    返回:
+        解密后的文件路径
+    """
+    if ncm_decrypt.is_ncm(input_path):
+        # NCM 用内置的解密实现，不启动 um.exe
+        output_path = ncm_decrypt.NcmFile(input_path).decrypt_to_file()
+        os.remove(input_path)
+        print(f"转换完成: {input_path}")
+        return output_path
+
+    folder = os.path.dirname(input_path)
+    stem = os.path.splitext(os.path.basename(input_path))[0]
+    before = set(glob.glob(os.path.join(glob.escape(folder), glob.escape(stem) + '.*')))
+    subprocess.run([os.path.join(path(), exe_path), os.path.join(path(), input_path)], check=True)
+    os.remove(input_path)
+    # um.exe 在原目录生成同名、扩展名为实际格式的文件
+    created = set(glob.glob(os.path.join(glob.escape(folder), glob.escape(stem) + '.*'))) - before
+    if not created:
+        raise RuntimeError(f"未找到解密输出: {input_path}")
+    print(f"转换完成: {input_path}")
+    return created.pop()
+
+
 def encryption(folder_path):
     """识别文件夹内的音频文件并转换为WAV格式"""
     # 常见的音频文件扩展名
-    audio_extensions = ['*.ncm', '*.kgm', '*.kwm']
-    not_recommended_ext = ['*.mflac', '*.qmc', '*.mgg']
-    exe_path=r'um.exe'
+    audio_extensions = ['*.' + ext for ext in ENCRYPTED_EXTENSIONS]
 
     for ext in audio_extensions:
         # 递归查找所有匹配的音频文件
         for input_path in glob.glob(os.path.join(folder_path, "**", ext), recursive=True):
 
             try:
-                # 获取文件扩展名(不带点)
-                file_ext = os.path.splitext(input_path)[1][1:]
-                #print(os.path.join(path(),exe_path))
-                if file_ext in not_recommended_ext:
-                    print(f"不推荐使用 {file_ext} 格式，可能会导致转换失败。")
-                    continue
-                subprocess.run([os.path.join(path(),exe_path), os.path.join(path(),input_path)], check=True)
-                os.remove(input_path)
-                print(f"转换完成: {input_path}")
+                decrypt_file(input_path)
 
             except Exception as e:
                 print(f"转换 {input_path} 时出错: {str(e)}")
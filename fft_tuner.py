@@ -0,0 +1,240 @@
+# FFT调优 - 在本机上为流水线用到的每个FFT长度比较FFT实现和线程数，
+# 结果保存在缓存目录的 fft_plans.json 中（类似 FFTW 的 wisdom），spectral_engine 按FFT长度查询
+# 不补零：补零到非 n_fft 整数倍的长度会让每行取到另一套bin网格上的值（改变标注频率上的幅值），
+# 而整数倍的长度消不掉大素因子，总比原长度慢；不同实现的舍入不同，非默认的实现记入分析缓存的键和清单
+# 用法: python fft_tuner.py [采样率 ...]   （默认使用 music_stft 中各文件的采样率）
+import os
+import sys
+import json
+import time
+import platform
+import numpy as np
+import scipy
+import scipy.fft
+import analysis_cache
+
+try:
+    import pyfftw.interfaces.scipy_fft as fftw_fft
+except ImportError:
+    fftw_fft = None  # 没有安装 pyFFTW 时只比较 scipy 和 numpy
+
+PLAN_NAME = 'fft_plans.json'
+PLAN_VERSION = 2        # 版本1含补零长度，已不再使用
+BENCH_REPEAT = 5        # 每个候选取最快的一次
+BENCH_FRAMES = 64       # 每次变换的帧数（与 spectral_engine.BLOCK_FRAMES 一致）
+
+# 流水线中的变换: (频率分辨率Hz, 帧移ms, 最高频率, 多速率)
+PIPELINE_TRANSFORMS = [
+    (10, 50, 20000, False),     # stft_unified / stft_unified_time
+    (3, 50, 3000, True),        # stft_3000_detailed
+    (1, 25, None, False),       # power / power_plt / power_aweighted
+]
+
+
+def _rfft_scipy(x, n, workers):
+    return scipy.fft.rfft(x, n=n, axis=1, workers=workers)
+
+
+def _rfft_numpy(x, n, workers):
+    return np.fft.rfft(x, n=n, axis=1)
+
+
+def _rfft_fftw(x, n, workers):
+    return fftw_fft.rfft(x, n=n, axis=1, workers=workers)
+
+
+BACKENDS = {'scipy': _rfft_scipy, 'numpy': _rfft_numpy}
+if fftw_fft is not None:
+    BACKENDS['fftw'] = _rfft_fftw
+
+
+class FFTPlan:
+    def __init__(self, backend='scipy', workers=1):
+        """
+        一个FFT长度的执行方式
+
+        参数:
+            backend: BACKENDS 中的实现
+            workers: FFT线程数（分段并行时不使用，见 spectral_engine；各行独立变换，不影响结果）
+        """
+        self.backend = backend if backend in BACKENDS else 'scipy'
+        self.workers = workers
+
+    def rfft(self, block, workers=None):
+        """对每行做实数FFT"""
+        return BACKENDS[self.backend](block, block.shape[1], self.workers if workers is None else workers)
+
+    def to_dict(self):
+        return {'backend': self.backend, 'workers': self.workers}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data.get('backend', 'scipy'), data.get('workers', 1))
+
+
+DEFAULT_PLAN = FFTPlan()
+
+
+def machine_id():
+    """计时结果只对同一台机器和同一组库版本有效"""
+    return {'machine': platform.machine(), 'processor': platform.processor(), 'cpus': os.cpu_count(),
+            'numpy': np.__version__, 'scipy': scipy.__version__}
+
+
+class PlanCache:
+    def __init__(self, path):
+        """
+        读取保存的调优结果（机器或库版本不同时忽略）
+
+        参数:
+            path: fft_plans.json 路径
+        """
+        self.path = path
+        self.plans = {}
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == PLAN_VERSION and data.get('machine') == machine_id():
+                self.plans = {key: FFTPlan.from_dict(value) for key, value in data.get('plans', {}).items()}
+            else:
+                print(f"{path} 不是在本机当前环境下生成的，忽略（请重新运行 fft_tuner.py）")
+        except (OSError, ValueError):
+            pass
+
+    def get(self, size):
+        return self.plans.get(str(size), DEFAULT_PLAN)
+
+    def set(self, size, plan):
+        self.plans[str(size)] = plan
+
+    def signature(self):
+        """使用非默认实现的长度 [[长度, 实现]]（舍入与 scipy 不同，用于分析缓存的键和清单），默认时为空"""
+        return sorted([int(key), plan.backend] for key, plan in self.plans.items()
+                      if plan.backend != DEFAULT_PLAN.backend)
+
+    def save(self):
+        """写入（先写临时文件再替换）"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        data = {'version': PLAN_VERSION, 'machine': machine_id(),
+                'plans': {key: plan.to_dict() for key, plan in sorted(self.plans.items())}}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+
+_plan_cache = None
+
+
+def plan_cache():
+    """当前缓存目录下的调优结果（首次调用时读取）"""
+    global _plan_cache
+    path = os.path.join(analysis_cache.get_cache().directory, PLAN_NAME)
+    if _plan_cache is None or _plan_cache.path != path:
+        _plan_cache = PlanCache(path)
+    return _plan_cache
+
+
+def get_plan(size):
+    """
+    FFT长度 size 的执行方式，没有调优结果时使用 scipy 单线程
+
+    参数:
+        size: 帧长（窗口大小）
+    """
+    return plan_cache().get(size)
+
+
+def plan_signature():
+    """当前生效的非默认实现，全部为默认时为空列表"""
+    return plan_cache().signature()
+
+
+def _time(func, block, workers, repeat):
+    n = block.shape[1]
+    func(block, n, workers)  # 预热（建立内部的变换计划）
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(block, n, workers)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def benchmark(size, max_workers=None, frames=BENCH_FRAMES, repeat=BENCH_REPEAT):
+    """
+    在本机上为一个FFT长度选择最快的实现和线程数
+
+    参数:
+        size: 帧长
+        max_workers: FFT线程数上限，默认CPU核数
+        frames: 每次变换的帧数
+        repeat: 每个候选的计时次数
+
+    返回:
+        (FFTPlan, 默认方案的耗时, 选中方案的耗时)
+    """
+    block = np.random.default_rng(0).standard_normal((frames, size))
+    max_workers = max_workers or os.cpu_count() or 1
+    worker_counts = sorted({1, *[w for w in (2, 4, 8, 16) if w <= max_workers]})
+
+    timings = {}
+    for backend, func in BACKENDS.items():
+        for workers in (worker_counts if backend != 'numpy' else [1]):
+            timings[(backend, workers)] = _time(func, block, workers, repeat)
+
+    best_time, (backend, workers) = min((t, key) for key, t in timings.items())
+    return FFTPlan(backend, workers), timings[(DEFAULT_PLAN.backend, DEFAULT_PLAN.workers)], best_time
+
+
+def pipeline_sizes(sr):
+    """
+    流水线在采样率 sr 下实际使用的FFT长度
+
+    返回:
+        帧长列表
+    """
+    import spectral_engine
+    sizes = []
+    for step_hz, hop_ms, max_freq, multirate in PIPELINE_TRANSFORMS:
+        request = spectral_engine.SpectralRequest(step_hz, hop_ms, max_freq, multirate=multirate)
+        n_fft, hop_length = request.frame_params(sr)
+        factor = spectral_engine.decimation_factor(sr, n_fft, hop_length, max_freq) if multirate else 1
+        sizes.append(n_fft // factor)
+    return sizes
+
+
+def tune(sample_rates, max_workers=None, log=print):
+    """
+    为给定采样率下流水线用到的每个FFT长度计时并保存结果
+
+    参数:
+        sample_rates: 采样率列表
+        max_workers: FFT线程数上限
+        log: 日志输出函数
+    """
+    cache = plan_cache()
+    for sr in sorted(set(sample_rates)):
+        for size in pipeline_sizes(sr):
+            plan, default_time, best_time = benchmark(size, max_workers)
+            cache.set(size, plan)
+            log(f"{sr} Hz, 帧长 {size}: {plan.backend} × {plan.workers} 线程 "
+                f"({default_time * 1000:.2f} ms -> {best_time * 1000:.2f} ms / {BENCH_FRAMES} 帧)")
+    cache.save()
+    log(f"已保存: {cache.path}")
+    return cache
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        rates = [int(arg) for arg in sys.argv[1:]]
+    else:
+        from audio_source import get_audio_info
+        rates = set()
+        for name in os.listdir('music_stft') if os.path.isdir('music_stft') else []:
+            try:
+                rates.add(get_audio_info(os.path.join('music_stft', name)).sr)
+            except Exception:
+                continue
+        rates = rates or {44100, 48000}
+    tune(rates)
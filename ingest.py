@@ -0,0 +1,110 @@
+# 并行流水线式导入 - 解密（和可选的WAV转换）在独立的线程池中进行，
+# NCM 文件不解密落盘，分析时直接从加密文件流式解码；每个文件准备好后立即通过有界队列交给分析进程池；队列满时导入线程等待（背压）
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import encryption
+import music_format
+import ncm_decrypt
+
+INGEST_WORKERS = 4      # 导入线程数（解密和转换都是外部进程/IO密集）
+QUEUE_SIZE = 8          # 已准备好、等待分析的文件数上限
+
+
+def ingest_file(path, write_wav=False):
+    """
+    把 music 目录下的一个文件准备为可分析的输入
+
+    参数:
+        path: 文件路径
+        write_wav: 是否把压缩格式转换为WAV（False 时分析阶段直接经 ffmpeg 管道解码）
+
+    返回:
+        可分析的文件路径
+    """
+    ext = os.path.splitext(path)[1][1:].lower()
+    if ncm_decrypt.is_ncm(path) and not write_wav:
+        # NCM 在分析阶段边读边解密，这里只校验文件头，不写解密后的文件
+        ncm_decrypt.NcmFile(path)
+        return path
+    if ext in encryption.ENCRYPTED_EXTENSIONS:
+        path = encryption.decrypt_file(path)
+        ext = os.path.splitext(path)[1][1:].lower()
+    if write_wav and ext in music_format.COMPRESSED_EXTENSIONS:
+        path = music_format.convert_file(path)
+    return path
+
+
+class IngestPipeline:
+    def __init__(self, directory='music_stft', write_wav=False, workers=INGEST_WORKERS, queue_size=QUEUE_SIZE,
+                 log=print):
+        """
+        导入流水线（生产者）
+
+        参数:
+            directory: 音乐文件目录
+            write_wav: 是否把压缩格式转换为WAV
+            workers: 导入线程数
+            queue_size: 输出队列容量
+            log: 日志输出函数
+        """
+        self.directory = directory
+        self.write_wav = write_wav
+        self.workers = workers
+        self.log = log
+        # 元素为 directory 下的文件名，None 表示全部导入完成
+        self.queue = queue.Queue(maxsize=queue_size)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self, names):
+        """
+        在后台开始导入
+
+        参数:
+            names: directory 下的文件名列表
+        """
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, args=(list(names),), daemon=True)
+        self._thread.start()
+        return self.queue
+
+    def stop(self):
+        """停止：不再开始新的导入，等待中的交付被放弃"""
+        self._stop.set()
+
+    def _put(self, item):
+        """放入队列；队列满时等待（背压），停止时放弃"""
+        while not self._stop.is_set():
+            try:
+                self.queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _ingest(self, name):
+        if self._stop.is_set():
+            return
+        try:
+            path = ingest_file(os.path.join(self.directory, name), self.write_wav)
+        except Exception as e:
+            self.log(f"导入 {name} 时出错: {str(e)}\n")
+            return
+        self._put(os.path.relpath(path, self.directory))
+
+    def _run(self, names):
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for _ in executor.map(self._ingest, names):
+                    pass
+        finally:
+            # 结束标记必须送达，否则消费者会一直等待
+            while True:
+                try:
+                    self.queue.put(None, timeout=0.5)
+                    break
+                except queue.Full:
+                    if self._stop.is_set():
+                        break
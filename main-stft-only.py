@@ -3,30 +3,91 @@ import re
 import datetime
 import time as t
 import sys
-import shutil
 import multiprocessing as mp
 import power_aweighted,stft_unified,stft_3000_detailed,power,power_plt,music_format
+import analysis_pool
+import ingest
+import analysis_cache
+import thread_budget
+import precision
+from audio_source import AudioSource
 
 
 # 全局变量，将在初始化函数中设置
 counter = None
 total_files = None
 lock = None
+spectrogram_renderer = "matplotlib"  # 频谱图渲染方式，"raster" 为快速直接渲染（不经过pyplot）
+processing_backend = "process"  # "process": 按阶段并行的进程池（音频经共享内存传递），"song": 每个进程处理一首歌
+memory_budget_gb = None  # 进程池模式的内存预算(GB)，None 表示启动时可用内存的75%
+analysis_cache_gb = 4  # 分析缓存（cache_stft/）的容量上限(GB)，0 表示禁用
+write_intermediate_wav = False  # True 时先把压缩格式转换为WAV（旧流程），False 时分析时直接经 ffmpeg 管道解码
+analysis_precision = "float64"  # 计算精度，"float32" 时音频、频谱和dB网格全程单精度（内存减半，误差见 precision.py）
+export_csv = False  # True 时频谱图阶段除 data.spec 外再导出旧格式的 data.csv（文本，体积大、写入慢）
 
 def format():
-    music_format.main()
+    music_format.main(write_wav=write_intermediate_wav)
     time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     with open(f'log_stft/log_main.txt', 'a', encoding='utf-8') as file:
             file.write(f'{time}: Format Finished.\n')
 
-format()
-
-def init_worker(counter_arg, total_arg, lock_arg):
+def init_worker(counter_arg, total_arg, lock_arg, budget=None):
     """初始化工作进程的全局变量"""
     global counter, total_files, lock
     counter = counter_arg
     total_files = total_arg
     lock = lock_arg
+    analysis_cache.configure(max_bytes=int(analysis_cache_gb * 1024 ** 3))
+    precision.set_precision(analysis_precision)
+    if budget is not None:
+        thread_budget.apply(budget)  # FFT线程数和原生库线程限制
+
+
+def song_folder_name(name):
+    """输出文件夹名称"""
+    return re.sub(r'[<>:"/\\|?*]', '', name).rsplit('.', 1)[0]
+
+
+def song_log(name, message):
+    """写入单首歌的日志"""
+    name_new = song_folder_name(name)
+    time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    with open(f'log_stft/log_{name_new}.txt', 'a', encoding='utf-8') as file:
+        file.write(f'{time}: {message}\n')
+
+
+def run_analysis_pool(tot_name, processes):
+    """导入流水线与按阶段并行的进程池同时运行，处理所有文件，返回成功处理的文件数"""
+    finished = 0
+
+    def on_song_start(name):
+        os.makedirs(f'data_stft/{song_folder_name(name)}', exist_ok=True)
+        song_log(name, 'Program Starting.')
+
+    def on_song_done(name, ok):
+        nonlocal finished
+        if not ok:
+            return
+        # 重新处理时清单保留了输出目录，上一次移入的同名文件直接覆盖
+        os.replace(f'music_stft/{name}', f'data_stft/{song_folder_name(name)}/{name}')
+        finished += 1
+        print(f'Song-{name} Finished! [{finished}/{len(tot_name)}]')
+
+    budget = int(memory_budget_gb * 1024 ** 3) if memory_budget_gb else None
+    pool = analysis_pool.AnalysisPool(processes, renderer=spectrogram_renderer,
+                                      log=lambda line: print(line, end=''), memory_budget=budget,
+                                      cache_max_bytes=int(analysis_cache_gb * 1024 ** 3),
+                                      precision_name=analysis_precision, export_csv=export_csv)
+    pipeline = ingest.IngestPipeline(write_wav=write_intermediate_wav, log=lambda line: print(line, end=''))
+    try:
+        pool.run(pipeline.start(tot_name), on_song_start=on_song_start, on_stage_done=song_log,
+                 on_song_done=on_song_done, total=len(tot_name))
+    except KeyboardInterrupt:
+        pool.stop()
+        raise
+    finally:
+        pipeline.stop()
+    return finished
 
 
 def process_music_file(name):
@@ -40,31 +101,34 @@ def process_music_file(name):
             folder = f'data_stft/{name_new}'  # 目标文件夹
             os.makedirs(folder, exist_ok=True)
 
+            # 每首歌只解码一次，各阶段共享同一份采样数据
+            source = AudioSource.load(f"music_stft/{name}")
+
             # 执行三个STFT处理
             # 替换原来的三个单独STFT处理
-            stft_unified.main(f"music_stft/{name}")  
+            stft_unified.main(source, renderer=spectrogram_renderer, export_csv=export_csv)
             time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             file.write(f'{time}: STFT Finished!\n')
 
-            stft_3000_detailed.main(f"music_stft/{name}")  
+            stft_3000_detailed.main(source, renderer=spectrogram_renderer)
             time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             file.write(f'{time}: STFT-3000 Finished!\n')
 
             # 新增能量计算
-            power.main(f"music_stft/{name}")  
+            power.main(source)
             time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             file.write(f'{time}: STFT-Power-Csv Finished!\n')
 
-            power_plt.main(f"music_stft/{name}")  
+            power_plt.main(source)
             time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             file.write(f'{time}: STFT-Power-Plt Finished!\n')
 
-            power_aweighted.main(f"music_stft/{name}")
+            power_aweighted.main(source)
             time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             file.write(f'{time}: STFT-Power-Plt-A-Weighting Finished!\n')
 
         # 移动原始文件到处理后的目录
-        shutil.move(f'music_stft/{name}', f'data_stft/{name_new}')
+        os.replace(f'music_stft/{name}', f'data_stft/{name_new}/{name}')
 
         # 更新计数器并显示进度
         with lock:
@@ -78,6 +142,10 @@ def process_music_file(name):
 
 
 if __name__ == "__main__":
+    # 只在主进程中格式化（工作进程会重新导入本模块）；进程池模式下由导入流水线逐个文件处理
+    if processing_backend != "process":
+        format()
+
     if not os.path.exists('data_stft'):
         os.mkdir('data_stft')
     if not os.path.exists('log_stft'):
@@ -92,19 +160,28 @@ if __name__ == "__main__":
     t1=t.time()
 
     try:
-        # 创建共享计数器和锁
-        counter = mp.Value('i', 0)
         total = len(tot_name)
-        lock = mp.Lock()
 
         # 创建进程池，使用CPU核心数量减2作为进程池大小
         processes = max(1, mp.cpu_count() - 2)
 
-        # 使用initializer和initargs正确传递共享对象
-        with mp.Pool(processes=processes, initializer=init_worker,
-                     initargs=(counter, total, lock)) as pool:
-            # 使用map执行处理
-            results = pool.map(process_music_file, tot_name)
+        if processing_backend == "process":
+            run_analysis_pool(tot_name, processes)
+        else:
+            # 创建共享计数器和锁
+            counter = mp.Value('i', 0)
+            lock = mp.Lock()
+
+            # 按歌曲数和时长在进程和每个进程的FFT线程之间分配核心
+            budget = thread_budget.plan(thread_budget.song_durations([f"{directory}/{n}" for n in tot_name]),
+                                        max_outer=processes)
+            print(f"线程分配: {budget}")
+
+            # 使用initializer和initargs正确传递共享对象
+            with mp.Pool(processes=budget.outer, initializer=init_worker,
+                         initargs=(counter, total, lock, budget)) as pool:
+                # 使用map执行处理
+                results = pool.map(process_music_file, tot_name)
 
         t2=t.time()
         delta_t=t2-t1
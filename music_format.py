@@ -3,33 +3,55 @@ from pydub import AudioSegment
 import glob
 
 
+# 需要转换为WAV的压缩格式
+COMPRESSED_EXTENSIONS = ['mp3', 'aac', 'ogg', 'flac', 'm4a', 'wma']
+
+
+def convert_file(input_path):
+    """
+    把单个压缩格式文件转换为WAV（成功后删除原文件）
+
+    返回:
+        WAV文件路径
+    """
+    # 输出WAV文件路径
+    output_path = os.path.splitext(input_path)[0] + '.wav'
+
+    print(f"正在转换: {input_path} -> {output_path}")
+
+    # 获取文件扩展名(不带点)
+    file_ext = os.path.splitext(input_path)[1][1:]
+    # 加载音频文件
+    audio = AudioSegment.from_file(input_path, format=file_ext)
+    # 导出为WAV格式
+    audio.export(output_path, format="wav")
+    os.remove(input_path)
+    print(f"转换完成: {output_path}")
+    return output_path
+
+
 def convert_to_wav(folder_path):
     """识别文件夹内的音频文件并转换为WAV格式"""
     # 常见的音频文件扩展名
-    audio_extensions = ['*.mp3', '*.aac', '*.ogg', '*.flac', '*.m4a', '*.wma']
+    audio_extensions = ['*.' + ext for ext in COMPRESSED_EXTENSIONS]
 
     for ext in audio_extensions:
         # 递归查找所有匹配的音频文件
         for input_path in glob.glob(os.path.join(folder_path, "**", ext), recursive=True):
-            # 输出WAV文件路径
-            output_path = os.path.splitext(input_path)[0] + '.wav'
-
-            print(f"正在转换: {input_path} -> {output_path}")
-
             try:
-                # 获取文件扩展名(不带点)
-                file_ext = os.path.splitext(input_path)[1][1:]
-                # 加载音频文件
-                audio = AudioSegment.from_file(input_path, format=file_ext)
-                # 导出为WAV格式
-                audio.export(output_path, format="wav")
-                os.remove(input_path)
-                print(f"转换完成: {output_path}")
+                convert_file(input_path)
             except Exception as e:
                 print(f"转换 {input_path} 时出错: {str(e)}")
 
 
 # 使用示例
-def main():
+def main(write_wav=True):
+    """
+    参数:
+        write_wav: 是否把压缩格式转换为WAV；False 时保留原文件，分析时由 ffmpeg 管道直接解码
+    """
+    if not write_wav:
+        print("跳过WAV转换，压缩格式将在分析时直接解码")
+        return
     folder_to_process = "music_stft"  # 修改为您的目标文件夹路径
     convert_to_wav(folder_to_process)
\ No newline at end of file
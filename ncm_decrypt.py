@@ -0,0 +1,266 @@
+# 网易云音乐 NCM 容器解密（纯Python，不依赖 um.exe，可在Linux上运行）
+# 文件结构: 魔数 | 密钥块(AES-128-ECB) | 元数据(AES-128-ECB, JSON) | CRC | 封面 | 加密音频
+# 音频部分用由密钥块生成的256字节循环密钥流异或，只取决于字节位置，因此可以随机访问解密：
+# NcmReader 是可 seek 的文件对象，soundfile 可直接从中解码，不需要先写出解密后的文件
+import io
+import os
+import json
+import base64
+import struct
+import numpy as np
+
+MAGIC = b'CTENFDAM'
+CORE_KEY = bytes.fromhex('687A4852416D736F356B496E62617857')
+META_KEY = bytes.fromhex('2331346C6A6B5F215C5D2630553C2728')
+BLOCK_SIZE = 1 << 20    # 流式解密的块大小
+
+
+# ---------------- AES-128 ECB 解密（只用于几百字节的密钥块和元数据）----------------
+
+def _xtime(a):
+    return ((a << 1) ^ 0x1b) & 0xff if a & 0x80 else a << 1
+
+
+def _gmul(a, b):
+    result = 0
+    while b:
+        if b & 1:
+            result ^= a
+        a = _xtime(a)
+        b >>= 1
+    return result
+
+
+def _build_sbox():
+    """按GF(2^8)求逆加仿射变换生成S盒和逆S盒"""
+    sbox = [0] * 256
+    p = q = 1
+    while True:
+        p = p ^ _xtime(p)                       # p *= 3
+        q ^= q << 1                              # q /= 3
+        q ^= q << 2
+        q ^= q << 4
+        q &= 0xff
+        if q & 0x80:
+            q ^= 0x09
+        x = q
+        for shift in range(1, 5):
+            x ^= ((q << shift) | (q >> (8 - shift))) & 0xff
+        sbox[p] = x ^ 0x63
+        if p == 1:
+            break
+    sbox[0] = 0x63
+    inv = [0] * 256
+    for i, value in enumerate(sbox):
+        inv[value] = i
+    return sbox, inv
+
+
+_SBOX, _INV_SBOX = _build_sbox()
+
+
+def _round_keys(key):
+    """AES-128 密钥扩展，返回11个16字节轮密钥"""
+    words = [list(key[i:i + 4]) for i in range(0, 16, 4)]
+    rcon = 1
+    for i in range(4, 44):
+        word = list(words[i - 1])
+        if i % 4 == 0:
+            word = [_SBOX[b] for b in word[1:] + word[:1]]
+            word[0] ^= rcon
+            rcon = _xtime(rcon)
+        words.append([a ^ b for a, b in zip(words[i - 4], word)])
+    return [sum(words[4 * r:4 * r + 4], []) for r in range(11)]
+
+
+def _decrypt_block(block, keys):
+    state = [b ^ k for b, k in zip(block, keys[10])]
+    for rnd in range(9, -1, -1):
+        # 逆行移位 + 逆字节代换
+        state = [_INV_SBOX[state[r + 4 * ((c - r) % 4)]] for c in range(4) for r in range(4)]
+        state = [b ^ k for b, k in zip(state, keys[rnd])]
+        if rnd:
+            mixed = []
+            for c in range(4):
+                a0, a1, a2, a3 = state[4 * c:4 * c + 4]
+                mixed += [_gmul(a0, 14) ^ _gmul(a1, 11) ^ _gmul(a2, 13) ^ _gmul(a3, 9),
+                          _gmul(a0, 9) ^ _gmul(a1, 14) ^ _gmul(a2, 11) ^ _gmul(a3, 13),
+                          _gmul(a0, 13) ^ _gmul(a1, 9) ^ _gmul(a2, 14) ^ _gmul(a3, 11),
+                          _gmul(a0, 11) ^ _gmul(a1, 13) ^ _gmul(a2, 9) ^ _gmul(a3, 14)]
+            state = mixed
+    return bytes(state)
+
+
+def aes_ecb_decrypt(data, key):
+    """AES-128-ECB 解密并去除PKCS7填充"""
+    keys = _round_keys(key)
+    plain = b''.join(_decrypt_block(data[i:i + 16], keys) for i in range(0, len(data), 16))
+    return plain[:-plain[-1]]
+
+
+# ---------------- NCM 容器 ----------------
+
+def _keystream(key):
+    """由密钥生成256字节循环密钥流（RC4式密钥编排，输出只取决于位置）"""
+    box = list(range(256))
+    last = 0
+    for i in range(256):
+        swap = box[i]
+        c = (swap + last + key[i % len(key)]) & 0xff
+        box[i] = box[c]
+        box[c] = swap
+        last = c
+    stream = bytearray(256)
+    for k in range(256):
+        j = (k + 1) & 0xff
+        stream[k] = box[(box[j] + box[(box[j] + j) & 0xff]) & 0xff]
+    return np.frombuffer(bytes(stream), dtype=np.uint8)
+
+
+class NcmFile:
+    def __init__(self, path):
+        """
+        解析NCM文件头
+
+        参数:
+            path: .ncm 文件路径
+
+        属性:
+            meta: 元数据（歌名、格式等），没有时为空字典
+            format: 音频格式（'mp3' 或 'flac'）
+            audio_offset: 加密音频在文件中的起始位置
+            audio_size: 音频字节数
+        """
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(8) != MAGIC:
+                raise ValueError(f"不是NCM文件: {path}")
+            f.seek(2, io.SEEK_CUR)
+
+            key_len, = struct.unpack('<I', f.read(4))
+            key_data = bytes(b ^ 0x64 for b in f.read(key_len))
+            key = aes_ecb_decrypt(key_data, CORE_KEY)[17:]   # 去掉 'neteasecloudmusic' 前缀
+
+            meta_len, = struct.unpack('<I', f.read(4))
+            self.meta = {}
+            if meta_len:
+                meta_data = bytes(b ^ 0x63 for b in f.read(meta_len))
+                meta_data = base64.b64decode(meta_data[22:])      # 去掉 "163 key(Don't modify):"
+                self.meta = json.loads(aes_ecb_decrypt(meta_data, META_KEY)[6:].decode('utf-8'))  # 去掉 'music:'
+
+            f.seek(5, io.SEEK_CUR)  # CRC32 + 1字节
+            cover_frame_len, image_size = struct.unpack('<II', f.read(8))
+            f.seek(max(cover_frame_len, image_size), io.SEEK_CUR)
+            self.audio_offset = f.tell()
+        self.audio_size = os.path.getsize(path) - self.audio_offset
+        self.format = self.meta.get('format', 'mp3')
+        self._stream = _keystream(key)
+        # 预先展开的密钥流，整块异或时直接切片
+        self._tiled = np.tile(self._stream, BLOCK_SIZE // 256 + 1)
+
+    def decrypt(self, data, position):
+        """
+        解密从音频第 position 字节开始的一段数据
+
+        参数:
+            data: 密文 bytes
+            position: 在音频部分中的起始位置
+        """
+        raw = np.frombuffer(data, dtype=np.uint8)
+        start = position % 256
+        if start + len(raw) <= len(self._tiled):
+            stream = self._tiled[start:start + len(raw)]
+        else:
+            stream = np.resize(np.roll(self._stream, -start), len(raw))
+        return (raw ^ stream).tobytes()
+
+    def iter_audio(self, block_size=BLOCK_SIZE):
+        """按块产出解密后的音频字节（可直接写入解码器的输入管道）"""
+        with open(self.path, 'rb') as f:
+            f.seek(self.audio_offset)
+            position = 0
+            while True:
+                data = f.read(block_size)
+                if not data:
+                    break
+                yield self.decrypt(data, position)
+                position += len(data)
+
+    def open(self):
+        """以可随机访问的文件对象打开解密后的音频"""
+        return NcmReader(self)
+
+    def decrypt_to_file(self, output_path=None):
+        """
+        把解密后的音频写成文件（默认与原文件同名、扩展名为实际格式）
+
+        返回:
+            输出文件路径
+        """
+        if output_path is None:
+            output_path = f"{os.path.splitext(self.path)[0]}.{self.format}"
+        with open(output_path, 'wb') as out:
+            for block in self.iter_audio():
+                out.write(block)
+        return output_path
+
+
+class NcmReader(io.RawIOBase):
+    def __init__(self, ncm):
+        """
+        解密后音频的只读文件对象（按需解密，支持seek，可交给 soundfile 直接解码）
+
+        参数:
+            ncm: NcmFile
+        """
+        super().__init__()
+        self.ncm = ncm
+        self._file = open(ncm.path, 'rb')
+        self._position = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        else:
+            self._position = self.ncm.audio_size + offset
+        self._position = max(self._position, 0)
+        return self._position
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.ncm.audio_size - self._position
+        self._file.seek(self.ncm.audio_offset + self._position)
+        data = self._file.read(size)
+        result = self.ncm.decrypt(data, self._position)
+        self._position += len(data)
+        return result
+
+    def readinto(self, buffer):
+        data = self.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+
+def is_ncm(path):
+    return path.lower().endswith('.ncm')
+
+
+def open_audio(path):
+    """打开NCM文件中解密后的音频（文件对象）"""
+    return NcmFile(path).open()
@@ -3,6 +3,8 @@ import numpy as np
 import pandas as pd
 import matplotlib
 import os
+import audio_source
+import power_spectrum
 matplotlib.use('Agg')  # 设置后端为非交互式 Agg
 import matplotlib.pyplot as plt
 def plt_drawing(audio_path):
@@ -28,10 +30,22 @@ def plt_drawing(audio_path):
     
     # 获取频率值（列名）
     frequencies = df.columns.astype(float)
-    
+
+    plot_relative_energy(frequencies, energy_values, png_output)
+
+
+def plot_relative_energy(frequencies, energy_values, png_output):
+    """
+    绘制相对能量图
+
+    参数:
+        frequencies: 频率列表
+        energy_values: 对应频率的能量总和列表
+        png_output: 输出图像路径
+    """
     # 由于文件已经限制为0-4000Hz范围，不需要过滤
-    filtered_freqs = frequencies
-    filtered_energy = energy_values
+    filtered_freqs = np.asarray(frequencies, dtype=float)
+    filtered_energy = np.asarray(energy_values, dtype=float)
     
     # 找到最大值及其索引
     max_value = filtered_energy.max()
@@ -64,6 +78,12 @@ def plt_drawing(audio_path):
     plt.close()  # 关闭图形，释放内存
 
 def main(audio):
-    plt_drawing(audio)
-    name = audio.split('/')[1].rsplit('.', 1)[0]
+    audio_path = audio_source.audio_path(audio)
+    name = audio_path.split('/')[1].rsplit('.', 1)[0]
+    if isinstance(audio, audio_source.AudioSource):
+        # 直接使用内存中的能量结果（与power.py共享同一次STFT），不再重读CSV
+        frequencies, energies = power_spectrum.frequency_energies(audio)
+        plot_relative_energy(frequencies, energies, f"data_stft/{name}/frequency_energy.png")
+    else:
+        plt_drawing(audio_path)
     print(f'Song: {name}- Plt Drawing Finished!')
\ No newline at end of file
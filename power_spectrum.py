@@ -0,0 +1,93 @@
+# 1Hz分辨率能量谱 - power.py、power_aweighted.py 和 power_plt.py 共用
+# 每首歌只做一次STFT，得到每个频率bin按时间求和的能量，其余输出都由它派生
+import numpy as np
+import spectral_engine
+from spectral_engine import SpectralRequest
+from audio_source import as_audio_source
+
+
+def get_bin_energy(audio, freq_step=1, hop_ms=25):
+    """
+    获取每个频率bin的能量总和，同一个AudioSource只计算一次
+
+    参数:
+        audio: 音频文件路径，或已解码的AudioSource
+        freq_step: 频率分辨率(Hz)
+        hop_ms: 帧移（毫秒）
+    """
+    source = as_audio_source(audio)
+
+    def compute():
+        print(f"执行STFT分析...")
+        # 经 AudioSource 调用，可以使用分析缓存和停止时的检查点
+        request = SpectralRequest(freq_step, hop_ms, center=True, scaling=None, output='energy')
+        result, = spectral_engine.analyze(source, [request])
+        return result.freq_bins, result.energy
+
+    return source.cached(('bin_energy', freq_step, hop_ms), compute)
+
+
+def aggregate_energies(freq_bins, bin_energy, freq_min=0, freq_max=20000, freq_step=1, freq_tolerance=1.0):
+    """
+    把每个bin的能量汇总到目标频率点（容差范围内的bin求和）
+
+    参数:
+        freq_bins: 每个bin的中心频率
+        bin_energy: 每个bin的能量总和
+        freq_min: 最小频率(Hz)
+        freq_max: 最大频率(Hz)
+        freq_step: 频率步长(Hz)
+        freq_tolerance: 频率容差(Hz)
+
+    返回:
+        frequencies: 频率列表
+        energies: 对应频率的能量总和列表
+    """
+    # 创建频率列表
+    frequencies = np.arange(freq_min, freq_max + 1, freq_step)
+    print(f"计算{len(frequencies)}个频率点的能量...")
+
+    # freq_bins 单调递增，容差范围内的bin是连续区间 [lo, hi)
+    lo = np.searchsorted(freq_bins, frequencies - freq_tolerance, side='left')
+    hi = np.searchsorted(freq_bins, frequencies + freq_tolerance, side='right')
+
+    # 按原判定条件 |f - target| <= tol 修正边界上的浮点舍入差异
+    n_bins = len(freq_bins)
+
+    def in_range(i):
+        return np.abs(freq_bins[np.clip(i, 0, n_bins - 1)] - frequencies) <= freq_tolerance
+
+    lo = np.where((lo > 0) & in_range(lo - 1), lo - 1, lo)
+    lo = np.where((lo < n_bins) & ~in_range(lo), lo + 1, lo)
+    hi = np.where((hi < n_bins) & in_range(hi), hi + 1, hi)
+    hi = np.where((hi > lo) & ~in_range(hi - 1), hi - 1, hi)
+    width = np.maximum(hi - lo, 0)
+
+    # 逐个偏移量累加区间内的bin（区间宽度很小），没有匹配bin的频率点能量为0
+    energies = np.zeros(len(frequencies))
+    for k in range(int(width.max(initial=0))):
+        idx = np.minimum(lo + k, n_bins - 1)
+        energies += np.where(k < width, bin_energy[idx], 0.0)
+
+    return frequencies, energies
+
+
+def frequency_energies(audio, freq_min=0, freq_max=20000, freq_step=1, freq_tolerance=1.0):
+    """
+    计算音频在指定频率范围内的能量总和（共享同一次STFT）
+
+    参数:
+        audio: 音频文件路径，或已解码的AudioSource
+        其余参数同 aggregate_energies
+
+    返回:
+        frequencies: 频率列表
+        energies: 对应频率的能量总和列表
+    """
+    source = as_audio_source(audio)
+
+    def compute():
+        freq_bins, bin_energy = get_bin_energy(source, freq_step)
+        return aggregate_energies(freq_bins, bin_energy, freq_min, freq_max, freq_step, freq_tolerance)
+
+    return source.cached(('energies', freq_min, freq_max, freq_step, freq_tolerance), compute)
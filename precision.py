@@ -0,0 +1,152 @@
+# 计算精度 - 'float64'（默认）或 'float32'
+# float32 模式下解码的音频、分帧加窗、复数谱（complex64）和幅值/dB网格全程为单精度，
+# 内存带宽和各阶段的峰值内存约减半；每个bin的能量按时间求和时仍用 float64 累加（向量很小）
+# 与 float64 结果的差异由 validate() 给出（python precision.py <音频文件> ...）
+import sys
+import time
+import numpy as np
+
+PRECISIONS = {'float64': np.float64, 'float32': np.float32}
+DEFAULT_PRECISION = 'float64'
+DB_EPS = 1e-10          # 转换为dB前的幅值下限
+# 验证报告按相对峰值的电平分档统计dB误差（单精度的舍入误差相对峰值是常数，越接近dB下限的格子误差越大）
+REPORT_LEVELS = (-40, -60, -80, -100, -120)
+
+_precision = DEFAULT_PRECISION
+
+
+def set_precision(name):
+    """
+    设置进程内的计算精度（开始处理前设置；进程池的工作进程按提交的选项设置）
+
+    参数:
+        name: 'float64' 或 'float32'
+    """
+    global _precision
+    if name not in PRECISIONS:
+        raise ValueError(f"不支持的精度: {name}（可选 {', '.join(PRECISIONS)}）")
+    _precision = name
+
+
+def get_precision():
+    """当前的计算精度名"""
+    return _precision
+
+
+def real_dtype():
+    """当前精度的实数类型（复数谱为对应的复数类型）"""
+    return PRECISIONS[_precision]
+
+
+def to_db(mag, floor_db, out=None):
+    """
+    线性幅值 → 峰值为0dB的对数振幅，并裁剪到 floor_db
+    所有步骤都在同一个缓冲中原地完成（不产生整矩阵大小的临时数组），保持 mag 的数据类型
+
+    参数:
+        mag: 幅值矩阵
+        floor_db: dB下限
+        out: 输出缓冲；传入 mag 本身时直接覆盖幅值，None 时新分配一个
+
+    返回:
+        spec_db: dB矩阵（即 out）
+        ref_db: 归一化参考值（减去前的最大dB）
+    """
+    spec_db = np.maximum(mag, DB_EPS, out=out)
+    np.log10(spec_db, out=spec_db)
+    spec_db *= 20
+    ref_db = float(spec_db.max()) if spec_db.size else 0.0
+    spec_db -= ref_db                                # 峰值设为 0 dB
+    np.maximum(spec_db, floor_db, out=spec_db)       # 裁剪到 floor_db
+    return spec_db, ref_db
+
+
+def _analyze(source, requests, name):
+    """用指定精度执行一次分析（不使用分析缓存），返回 (结果, 耗时, 幅值网格字节数)"""
+    import spectral_engine
+    from audio_source import AudioSource
+    previous = _precision
+    set_precision(name)
+    try:
+        # 不带内容哈希：不读写分析缓存，两种精度都真正计算一次
+        samples = np.asarray(source.samples, dtype=real_dtype())
+        start = time.perf_counter()
+        results = spectral_engine.analyze(AudioSource(source.path, samples, source.sr, source.channels), requests)
+        elapsed = time.perf_counter() - start
+    finally:
+        set_precision(previous)
+    nbytes = sum(r.mag.nbytes for r in results if isinstance(r, spectral_engine.SpectrogramGrid))
+    return results, elapsed, nbytes
+
+
+def validate(audio, floor_db=-120.0, log=print):
+    """
+    对一首歌分别用 float64 和 float32 执行流水线中的全部变换，报告 float32 结果的误差上界
+
+    参数:
+        audio: 音频文件路径，或已解码的AudioSource
+        floor_db: dB下限（与频谱图一致）
+        log: 日志输出函数
+
+    返回:
+        报告字典: 'grids' 为每个幅值网格按电平分档的最大dB误差，'energy' 为能量谱的相对误差，
+        以及两种精度的耗时和幅值网格内存
+    """
+    import spectral_engine
+    import power_spectrum
+    from spectral_engine import SpectralRequest
+    from audio_source import as_audio_source
+    source = as_audio_source(audio)
+
+    # 与 stft_unified、stft_3000_detailed 和能量谱阶段相同的请求
+    requests = [SpectralRequest(10, 50, max_freq) for max_freq in (4000, 8000, 20000)]
+    requests.append(SpectralRequest(3, 50, 3000, multirate=True))
+    requests.append(SpectralRequest(1, 25, center=True, scaling=None, output='energy'))
+    labels = ['10Hz/50ms ≤4000Hz', '10Hz/50ms ≤8000Hz', '10Hz/50ms ≤20000Hz', '3Hz/50ms ≤3000Hz', '1Hz/25ms 能量']
+
+    log(f"精度验证: {source.path or '采样数组'} ({source.duration:.1f} 秒)")
+    reference, time64, bytes64 = _analyze(source, requests, 'float64')
+    single, time32, bytes32 = _analyze(source, requests, 'float32')
+
+    report = {'grids': {}, 'time': {'float64': time64, 'float32': time32},
+              'grid_bytes': {'float64': bytes64, 'float32': bytes32}}
+    for label, ref, res in zip(labels, reference, single):
+        if isinstance(ref, spectral_engine.BinEnergy):
+            continue
+        ref_db, _ = to_db(ref.mag, floor_db)
+        res_db, _ = to_db(res.mag, floor_db)
+        error = np.abs(res_db.astype(np.float64) - ref_db)
+        # 按 float64 结果的电平分档：电平不低于 level 的格子中的最大误差
+        levels = {level: float(error[ref_db >= level].max(initial=0.0)) for level in REPORT_LEVELS
+                  if level >= floor_db}
+        report['grids'][label] = {'max_db': float(error.max(initial=0.0)), 'levels': levels}
+        log(f"  {label}: 最大误差 {error.max(initial=0.0):.4f} dB; "
+            + ", ".join(f"≥{level}dB: {value:.4f}" for level, value in levels.items()))
+
+    energy64, energy32 = reference[-1].energy, single[-1].energy
+    significant = energy64 > energy64.max() * 1e-9
+    relative = np.abs(energy32[significant] - energy64[significant]) / energy64[significant]
+    freqs, agg64 = power_spectrum.aggregate_energies(reference[-1].freq_bins, energy64)
+    _, agg32 = power_spectrum.aggregate_energies(single[-1].freq_bins, energy32)
+    report['energy'] = {
+        'max_relative': float(relative.max(initial=0.0)),
+        'total_relative': float(abs(energy32.sum() - energy64.sum()) / energy64.sum()),
+        'peak_freq': (float(freqs[np.argmax(agg64)]), float(freqs[np.argmax(agg32)])),
+    }
+    log(f"  {labels[-1]}: 每个bin最大相对误差 {report['energy']['max_relative']:.2e} "
+        f"(只统计高于峰值-90dB的bin), 总能量相对误差 {report['energy']['total_relative']:.2e}, "
+        f"峰值频率 {report['energy']['peak_freq'][0]:.0f} / {report['energy']['peak_freq'][1]:.0f} Hz")
+    log(f"  幅值网格内存: {bytes64 / 1024 ** 2:.1f} MB -> {bytes32 / 1024 ** 2:.1f} MB; "
+        f"耗时: {time64:.2f} s -> {time32:.2f} s")
+    return report
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("用法: python precision.py <音频文件> ...")
+        sys.exit(1)
+    # 作为脚本运行时本模块是 __main__，而 spectral_engine 使用的是导入的 precision 模块，
+    # 必须通过后者切换精度，否则两次分析都是 float64
+    import precision
+    for path in sys.argv[1:]:
+        precision.validate(path)
@@ -0,0 +1,189 @@
+# 频谱图快速渲染 - 不经过pyplot，dB矩阵直接查表着色后写PNG
+# 频率轴和色标是按像素尺寸渲染的小图条（Figure + Agg，不使用pyplot全局状态，可在线程中使用），
+# 时间轴的刻度直接画进像素数组，刻度标签和标题是缓存的固定大小文字图块，
+# 因此没有与歌曲长度成正比的Agg画布（Agg单边上限65536像素）
+import functools
+import struct
+import zlib
+import numpy as np
+import matplotlib
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.cm import ScalarMappable
+from matplotlib.colors import Normalize
+from matplotlib.ticker import MaxNLocator
+
+DPI = 100
+TITLE_PX = 40       # 顶部标题条高度
+LEFT_PX = 80        # 左侧频率轴宽度
+BOTTOM_PX = 45      # 底部时间轴高度
+COLORBAR_PX = 90    # 右侧色标宽度
+PAD_PX = 10         # 左右图条上下多出的高度，避免首尾刻度标签被裁掉
+LABEL_W = 100       # 时间刻度标签图块宽度（刻度间距不小于它，见 _time_axis）
+LABEL_H = 16
+TITLE_W = 1200      # 标题图块宽度（居中粘贴，图像更窄时裁掉两侧空白）
+TICK_PX = 5         # 刻度线长度
+
+
+@functools.lru_cache(maxsize=8)
+def colormap_lut(cmap="magma"):
+    """256级颜色查找表，形状 (256, 3) uint8"""
+    lut = matplotlib.colormaps[cmap](np.linspace(0, 1, 256))[:, :3]
+    return np.round(lut * 255).astype(np.uint8)
+
+
+def colorize(spec_db, vmin, vmax, cmap="magma"):
+    """
+    把dB矩阵映射为RGB像素（低频在下方），与 imshow(vmin, vmax) 的量化方式一致
+
+    参数:
+        spec_db: 形状 (频率, 时间)
+        vmin, vmax: 颜色范围
+        cmap: 颜色映射名称
+
+    返回:
+        形状 (频率, 时间, 3) 的 uint8 数组
+    """
+    level = (spec_db[::-1] - vmin) * (256.0 / (vmax - vmin))
+    index = np.clip(level, 0, 255).astype(np.uint8)
+    return colormap_lut(cmap)[index]
+
+
+def write_png(path, rgb, level=3):
+    """把 (高, 宽, 3) 的uint8数组写成PNG（只依赖zlib）"""
+    height, width, _ = rgb.shape
+    raw = np.empty((height, width * 3 + 1), dtype=np.uint8)
+    raw[:, 0] = 0  # 每行的过滤类型: None
+    raw[:, 1:] = rgb.reshape(height, -1)
+
+    def chunk(tag, payload):
+        return (struct.pack(">I", len(payload)) + tag + payload
+                + struct.pack(">I", zlib.crc32(tag + payload) & 0xffffffff))
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", header))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), level)))
+        f.write(chunk(b"IEND", b""))
+
+
+def _render(width_px, height_px, draw):
+    """用Agg画布渲染一个指定像素大小的图条，返回RGB数组"""
+    fig = Figure(figsize=(width_px / DPI, height_px / DPI), dpi=DPI)
+    canvas = FigureCanvasAgg(fig)
+    draw(fig)
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba())[:height_px, :width_px, :3].copy()
+
+
+def _axis_only(ax, keep):
+    """只保留一条坐标轴"""
+    ax.patch.set_visible(False)
+    for side, spine in ax.spines.items():
+        spine.set_visible(side == keep)
+
+
+def _side_rect(height_px, left, width):
+    """左右图条中与频谱像素等高的区域（上下各留 PAD_PX）"""
+    total = height_px + 2 * PAD_PX
+    return [left, PAD_PX / total, width, height_px / total]
+
+
+@functools.lru_cache(maxsize=32)
+def _freq_axis(height_px, f_min, f_max):
+    def draw(fig):
+        ax = fig.add_axes(_side_rect(height_px, 0.999, 0.001))
+        _axis_only(ax, "right")
+        ax.set_ylim(f_min, f_max)
+        ax.yaxis.tick_left()
+        ax.yaxis.set_label_position("left")
+        ax.set_xticks([])
+        ax.set_ylabel("Frequency (Hz)")
+    return _render(LEFT_PX, height_px + 2 * PAD_PX, draw)
+
+
+@functools.lru_cache(maxsize=32)
+def _colorbar(height_px, vmin, vmax, cmap):
+    def draw(fig):
+        cax = fig.add_axes(_side_rect(height_px, 0.1, 0.15))
+        fig.colorbar(ScalarMappable(Normalize(vmin, vmax), cmap), cax=cax, label="Amplitude (dB)")
+    return _render(COLORBAR_PX, height_px + 2 * PAD_PX, draw)
+
+
+@functools.lru_cache(maxsize=256)
+def _text(text, width_px, height_px, fontsize):
+    """居中的一段文字（白底）"""
+    def draw(fig):
+        fig.text(0.5, 0.5, text, ha="center", va="center", fontsize=fontsize)
+    return _render(width_px, height_px, draw)
+
+
+def _stamp(canvas, image, top, center_x):
+    """把文字图块以 center_x 为中心叠加到画布上（取较深的颜色，超出画布的部分裁掉）"""
+    left = center_x - image.shape[1] // 2
+    x0, x1 = max(left, 0), min(left + image.shape[1], canvas.shape[1])
+    if x1 > x0:
+        region = canvas[top:top + image.shape[0], x0:x1]
+        np.minimum(region, image[:region.shape[0], x0 - left:x1 - left], out=region)
+
+
+def _tick_labels(ticks):
+    """刻度标签文本，小数位数按刻度间距统一"""
+    step = np.min(np.diff(ticks)) if len(ticks) > 1 else 1.0
+    decimals = max(0, -int(np.floor(np.log10(step)))) if step > 0 else 0
+    return [f"{value:.{decimals}f}" for value in ticks]
+
+
+def _time_axis(strip, left, width_px, t_min, t_max):
+    """
+    在底部图条（整幅图宽的像素数组，频谱从 left 列开始、宽 width_px）中画时间轴：
+    轴线和刻度线直接写像素，标签粘贴缓存的文字图块（首尾标签可以伸进两侧的空白）
+    """
+    strip[0, left:left + width_px] = 0
+    if t_max > t_min:
+        # 刻度位置的选取与 matplotlib 相同，每个刻度间隔至少 LABEL_W 像素
+        ticks = MaxNLocator(nbins=max(width_px // LABEL_W, 2)).tick_values(t_min, t_max)
+        ticks = ticks[(ticks >= t_min - 1e-9) & (ticks <= t_max + 1e-9)]
+        for value, label in zip(ticks, _tick_labels(ticks)):
+            x = left + min(int(round((value - t_min) / (t_max - t_min) * width_px)), width_px - 1)
+            strip[:TICK_PX, x] = 0
+            _stamp(strip, _text(label, LABEL_W, LABEL_H, 10), TICK_PX + 2, x)
+    _stamp(strip, _text("Time (s)", LABEL_W, LABEL_H, 10), TICK_PX + 4 + LABEL_H, left + width_px // 2)
+
+
+def render_spectrogram(png_path, spec_db, times, freqs, vmin, vmax=0, title="", cmap="magma",
+                       x_scale=1, y_scale=1, figsize=None, dpi=150):
+    """
+    渲染并保存频谱图PNG
+
+    参数:
+        png_path: 输出路径
+        spec_db: dB矩阵，形状 (频率, 时间)
+        times: 每帧时间(秒)
+        freqs: 每行频率(Hz)
+        vmin, vmax: 颜色范围(dB)
+        title: 标题
+        cmap: 颜色映射名称
+        x_scale, y_scale: 每个时间帧/频率行占用的像素数
+        figsize, dpi: 给出时按 matplotlib 图像尺寸（英寸）换算整数像素倍数，覆盖 x_scale/y_scale
+    """
+    if figsize is not None:
+        x_scale = max(1, round(figsize[0] * dpi / spec_db.shape[1]))
+        y_scale = max(1, round(figsize[1] * dpi / spec_db.shape[0]))
+
+    image = colorize(spec_db, vmin, vmax, cmap)
+    if x_scale > 1 or y_scale > 1:
+        image = image.repeat(y_scale, axis=0).repeat(x_scale, axis=1)
+    height, width, _ = image.shape
+
+    total_w = LEFT_PX + width + COLORBAR_PX
+    canvas = np.full((TITLE_PX + height + BOTTOM_PX, total_w, 3), 255, dtype=np.uint8)
+    rows = slice(TITLE_PX - PAD_PX, TITLE_PX + height + PAD_PX)
+    _stamp(canvas, _text(title, TITLE_W, TITLE_PX, 12), 0, total_w // 2)
+    canvas[rows, :LEFT_PX] = _freq_axis(height, float(freqs[0]), float(freqs[-1]))
+    canvas[rows, LEFT_PX + width:] = _colorbar(height, float(vmin), float(vmax), cmap)
+    canvas[TITLE_PX:TITLE_PX + height, LEFT_PX:LEFT_PX + width] = image
+    _time_axis(canvas[TITLE_PX + height:], LEFT_PX, width, float(times[0]), float(times[-1]))
+
+    write_png(png_path, canvas)
@@ -0,0 +1,121 @@
+# 频谱dB矩阵的二进制存储 - 替代 data.csv
+# 文件结构: 8字节魔数 | 8字节头长度 | JSON头（补齐到64字节对齐）| float32 数据 (时间, 频率)
+# 数据按时间分块写入，读取时用 np.memmap 映射，只读取需要的时间/频率窗口
+import json
+import struct
+import sys
+import numpy as np
+import pandas as pd
+import spectral_engine
+
+MAGIC = b"SPECv1\0\0"
+ALIGN = 64
+CHUNK_FRAMES = 1024  # 每次写入的帧数
+
+
+def write_store(path, spec_db, grid, floor_db, ref_db, chunk_frames=CHUNK_FRAMES):
+    """
+    保存dB矩阵
+
+    参数:
+        path: 输出路径（约定扩展名 .spec）
+        spec_db: dB矩阵，形状 (频率, 时间)，与频谱图相同
+        grid: 产生该矩阵的 spectral_engine.SpectrogramGrid（提供时间轴参数）
+        floor_db: dB下限
+        ref_db: 归一化参考值（减去前的最大dB，峰值设为0dB时减去的量）
+        chunk_frames: 每次写入的帧数
+    """
+    n_freqs, n_frames = spec_db.shape
+    # 截取片段的帧时间相对片段起点，不一定落在从0开始的分帧网格上，记录其偏移
+    time_offset = 0.0
+    if n_frames:
+        first = spectral_engine.frame_times(1, grid.n_fft, grid.hop_length, grid.center)[0] / grid.sr
+        time_offset = float(grid.times[0] - first)
+    header = {
+        "version": 1,
+        "dtype": "<f4",
+        "shape": [n_frames, n_freqs],   # 行：时间，列：频率（与 data.csv 一致）
+        "freqs": np.asarray(grid.freqs).tolist(),
+        "sr": grid.sr,
+        "n_fft": grid.n_fft,
+        "hop_length": grid.hop_length,
+        "center": grid.center,
+        "time_offset": time_offset,
+        "floor_db": float(floor_db),
+        "ref_db": float(ref_db),
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    data_offset = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGN) * ALIGN
+    header_bytes = header_bytes.ljust(data_offset - len(MAGIC) - 8, b" ")
+
+    with open(path, "wb") as f:
+        f.write(MAGIC)
+        f.write(struct.pack("<Q", len(header_bytes)))
+        f.write(header_bytes)
+        for start in range(0, n_frames, chunk_frames):
+            block = spec_db[:, start:start + chunk_frames].T
+            f.write(np.ascontiguousarray(block, dtype="<f4").tobytes())
+
+
+class SpectrogramStore:
+    def __init__(self, path):
+        """
+        以内存映射方式打开 .spec 文件（不会整体读入内存）
+
+        参数:
+            path: 文件路径
+        """
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"不是频谱存储文件: {path}")
+            header_len, = struct.unpack("<Q", f.read(8))
+            self.header = json.loads(f.read(header_len).decode("utf-8"))
+        offset = len(MAGIC) + 8 + header_len
+        self.data = np.memmap(path, dtype=self.header["dtype"], mode="r",
+                              offset=offset, shape=tuple(self.header["shape"]))
+        self.freqs = np.asarray(self.header["freqs"])
+        n_frames = self.header["shape"][0]
+        self.times = spectral_engine.frame_times(n_frames, self.header["n_fft"], self.header["hop_length"],
+                                                 self.header["center"]) / self.header["sr"]
+        self.times += self.header.get("time_offset", 0.0)
+
+    @property
+    def floor_db(self):
+        return self.header["floor_db"]
+
+    @property
+    def ref_db(self):
+        return self.header["ref_db"]
+
+    def window(self, t_start=None, t_end=None, f_min=None, f_max=None):
+        """
+        读取一个时间/频率窗口（闭区间），只访问对应的数据页
+
+        返回:
+            times: 窗口内的帧时间(秒)
+            freqs: 窗口内的频率(Hz)
+            values: dB值，形状 (时间, 频率)
+        """
+        t0 = 0 if t_start is None else np.searchsorted(self.times, t_start, side="left")
+        t1 = len(self.times) if t_end is None else np.searchsorted(self.times, t_end, side="right")
+        f0 = 0 if f_min is None else np.searchsorted(self.freqs, f_min, side="left")
+        f1 = len(self.freqs) if f_max is None else np.searchsorted(self.freqs, f_max, side="right")
+        return self.times[t0:t1], self.freqs[f0:f1], np.asarray(self.data[t0:t1, f0:f1])
+
+    def to_csv(self, csv_path, csv_digits=3):
+        """导出为与旧版 data.csv 相同格式的CSV（行：时间，列：频率；数据为float32，末位舍入可能不同）"""
+        df = pd.DataFrame(self.data, index=self.times, columns=self.freqs)
+        df.to_csv(csv_path, float_format=f"%.{csv_digits}f")
+
+
+def open_store(path):
+    """打开 .spec 文件"""
+    return SpectrogramStore(path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("用法: python spec_store.py <data.spec> <输出CSV路径>")
+        sys.exit(1)
+    open_store(sys.argv[1]).to_csv(sys.argv[2])
+    print(f"已导出CSV: {sys.argv[2]}")
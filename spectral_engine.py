@@ -0,0 +1,549 @@
+# 多分辨率STFT引擎 - stft_unified、stft_3000_detailed、stft_unified_time 和能量谱共用
+# 一次调用处理多个 (频率分辨率, 帧移, 最高频率) 请求：窗口和帧移相同的请求共用
+# 一次分帧和FFT（不同最高频率只是取不同的行），窗函数按窗口大小缓存
+# 只需要低频部分的请求可以先低通抽取再做短得多的FFT（多速率模式），频率网格不变
+# 带内容哈希的 AudioSource 的结果会放入分析缓存（analysis_cache），相同音频和参数直接读取
+# 长信号按帧分段（相邻段的采样重叠 n_fft-hop，分段边界对齐到帧）在多个线程中变换，
+# 分段固定、与线程数无关，所以结果在任何线程数下都完全相同
+# 每块之间检查取消令牌（cancellation）：暂停时原地等待，停止时把从头连续完成的块写入检查点
+# （分析缓存禁用时写入临时目录），下次处理同一首歌时从检查点继续
+# 每个FFT长度的实现和线程数来自本机的调优结果（fft_tuner），没有调优时用 scipy 单线程
+# 计算精度由 precision 模块决定：float32 时采样、窗函数、复数谱和幅值网格都是单精度
+import os
+import tempfile
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from scipy.signal import get_window, decimate
+import analysis_cache
+import cancellation
+import fft_tuner
+import precision
+from audio_source import AudioSource
+
+# 每次变换的帧数，决定中间复数谱的峰值内存（与歌曲长度无关）
+BLOCK_FRAMES = 64
+
+# 分段并行：每段帧数（BLOCK_FRAMES 的整数倍），以及启用多线程的最少帧数
+SEGMENT_FRAMES = 2048
+MIN_PARALLEL_FRAMES = 4 * SEGMENT_FRAMES
+
+# 单个变换使用的线程数（见 set_workers）
+_workers = 1
+
+# 停止时保存的检查点大小上限（幅值网格很大时保存本身就很慢，不如重新计算）
+CHECKPOINT_MAX_BYTES = 256 * 1024 * 1024
+# 分析缓存禁用时检查点的保存位置和容量上限
+CHECKPOINT_DIR = os.path.join(tempfile.gettempdir(), 'spectrum_checkpoints')
+CHECKPOINT_STORE_BYTES = 2 * 1024 ** 3
+
+# 多速率模式下最高频率占抽取后奈奎斯特频率的比例上限
+# （scipy.signal.decimate 的IIR低通截止在0.8倍，这里留出余量保证通带平坦）
+MULTIRATE_BAND = 0.75
+
+
+class SpectralRequest:
+    def __init__(self, step_hz, hop_ms, max_freq=None, center=False, scaling='spectrum', output='magnitude',
+                 multirate=False):
+        """
+        一个STFT输出请求
+
+        参数:
+            step_hz: 频率分辨率(Hz)，窗口大小 = round(sr/step_hz)（取偶数）
+            hop_ms: 帧移（毫秒）
+            max_freq: 输出的最高频率(Hz)，None表示到奈奎斯特频率
+            center: True时两端补零半个窗口（librosa.stft约定），
+                    False时第一帧从0开始（scipy.signal.stft boundary=None约定）
+            scaling: 'spectrum'时除以窗函数之和（scipy约定），None不缩放（librosa约定）
+            output: 'magnitude' 返回按 step_hz 取样的幅值网格，
+                    'energy' 返回每个bin的 |X|^2 按时间求和
+            multirate: 允许先低通抽取再做FFT（频率网格和分辨率不变；只对 center=False 的幅值请求生效）。
+                       幅值与不抽取时的差异：高于峰值-60dB的格子约0.07~0.12dB，
+                       低于-80dB且高频成分很强时（抗混叠滤波器的阻带泄漏）可达约0.5dB
+        """
+        self.step_hz = step_hz
+        self.hop_ms = hop_ms
+        self.max_freq = max_freq
+        self.center = center
+        self.scaling = scaling
+        self.output = output
+        self.multirate = multirate
+
+    def cache_params(self, sr, n_samples):
+        """分析缓存的参数（决定结果的全部输入）"""
+        return {'step_hz': self.step_hz, 'hop_ms': self.hop_ms, 'max_freq': self.max_freq, 'center': self.center,
+                'scaling': self.scaling, 'output': self.output, 'multirate': self.multirate,
+                'sr': sr, 'n_samples': n_samples}
+
+    def frame_params(self, sr):
+        """返回 (n_fft, hop_length)"""
+        hop_length = int(sr * self.hop_ms / 1000)  # 帧移，单位为样本数
+        n_fft = int(round(sr / self.step_hz))      # 窗口大小，决定频率分辨率
+        n_fft += n_fft % 2                         # 确保是偶数
+        return n_fft, hop_length
+
+
+class SpectrogramGrid:
+    def __init__(self, freqs, times, mag, n_fft, hop_length, sr=None, center=False):
+        """
+        幅值谱网格
+
+        参数:
+            freqs: 目标频率 (0, step_hz, 2*step_hz, ...)
+            times: 每帧中心时间(秒)
+            mag: 幅值，形状 (len(freqs), len(times))
+            n_fft: 窗口大小
+            hop_length: 帧移（样本数）
+            sr: 采样率
+            center: 分帧是否两端补零（决定帧时间的起点）
+        """
+        self.freqs = freqs
+        self.times = times
+        self.mag = mag
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+        self.sr = sr
+        self.center = center
+
+    def band(self, max_freq):
+        """
+        只保留不超过 max_freq 的行（目标频率网格是前缀，结果与单独请求该最高频率相同）
+        """
+        n_rows = np.searchsorted(self.freqs, max_freq, side='right')
+        return SpectrogramGrid(self.freqs[:n_rows], self.times, self.mag[:n_rows], self.n_fft, self.hop_length,
+                               self.sr, self.center)
+
+    def clip(self, start_time, end_time):
+        """
+        截取窗口完全落在 [start_time, end_time) 内的帧（至少保留一帧），不重新做FFT
+
+        返回:
+            新的 SpectrogramGrid，帧时间改为相对 start_time
+        """
+        start_sample = int(start_time * self.sr)
+        end_sample = int(end_time * self.sr)
+        frame_start = np.arange(len(self.times)) * self.hop_length - (self.n_fft // 2 if self.center else 0)
+        i0 = min(np.searchsorted(frame_start, start_sample, side='left'), max(len(frame_start) - 1, 0))
+        i1 = max(np.searchsorted(frame_start + self.n_fft, end_sample, side='right'), i0 + 1)
+        return SpectrogramGrid(self.freqs, self.times[i0:i1] - start_sample / self.sr, self.mag[:, i0:i1],
+                               self.n_fft, self.hop_length, self.sr, self.center)
+
+    def to_arrays(self):
+        return {'freqs': self.freqs, 'times': self.times, 'mag': self.mag, 'n_fft': self.n_fft,
+                'hop_length': self.hop_length, 'sr': self.sr, 'center': self.center}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['freqs'], arrays['times'], arrays['mag'], int(arrays['n_fft']),
+                   int(arrays['hop_length']), arrays['sr'].item(), bool(arrays['center']))
+
+
+class BinEnergy:
+    def __init__(self, freq_bins, energy, n_fft, hop_length):
+        """
+        每个FFT bin按时间求和的能量
+
+        参数:
+            freq_bins: 每个bin的中心频率
+            energy: 每个bin的能量总和
+            n_fft: 窗口大小
+            hop_length: 帧移（样本数）
+        """
+        self.freq_bins = freq_bins
+        self.energy = energy
+        self.n_fft = n_fft
+        self.hop_length = hop_length
+
+    def to_arrays(self):
+        return {'freq_bins': self.freq_bins, 'energy': self.energy, 'n_fft': self.n_fft,
+                'hop_length': self.hop_length}
+
+    @classmethod
+    def from_arrays(cls, arrays):
+        return cls(arrays['freq_bins'], arrays['energy'], int(arrays['n_fft']), int(arrays['hop_length']))
+
+
+@functools.lru_cache(maxsize=32)
+def hann_window(n_fft):
+    """周期Hann窗（与scipy/librosa的'hann'一致），按窗口大小缓存"""
+    window = get_window('hann', n_fft, fftbins=True)
+    window.setflags(write=False)
+    return window
+
+
+@functools.lru_cache(maxsize=32)
+def analysis_window(n_fft, scaling, dtype=np.float64):
+    """变换用的窗函数（scaling='spectrum' 时除以窗函数之和），按窗口大小、缩放方式和精度缓存"""
+    window = hann_window(n_fft)
+    if scaling == 'spectrum':
+        window = window / window.sum()
+    window = window.astype(dtype, copy=False)
+    window.setflags(write=False)
+    return window
+
+
+def frame_count(n_samples, n_fft, hop_length, center):
+    """信号分帧后的帧数"""
+    if center:
+        n_samples += 2 * (n_fft // 2)
+    return 1 + (max(n_samples, n_fft) - n_fft) // hop_length
+
+
+def frame_times(n_frames, n_fft, hop_length, center):
+    """每帧中心时间（样本）"""
+    offset = 0 if center else n_fft / 2
+    return offset + np.arange(n_frames) * hop_length
+
+
+def frame_signal(y, n_fft, hop_length, center):
+    """
+    把信号分帧为只读的跨步视图（不复制数据）
+
+    返回:
+        frames: 形状 (n_frames, n_fft)
+        times: 每帧中心时间（样本）
+    """
+    if center:
+        y = np.pad(y, n_fft // 2, mode='constant')
+    if len(y) < n_fft:
+        # 比一个窗口还短的信号补零到一帧
+        y = np.pad(y, (0, n_fft - len(y)), mode='constant')
+    frames = np.lib.stride_tricks.sliding_window_view(y, n_fft)[::hop_length]
+    return frames, frame_times(len(frames), n_fft, hop_length, center)
+
+
+def set_workers(workers):
+    """
+    设置单个长信号变换使用的线程数（FFT和逐元素运算会释放GIL）
+
+    参数:
+        workers: 线程数，1 表示不分段并行
+    """
+    global _workers
+    _workers = max(1, int(workers))
+
+
+def get_workers():
+    """当前的分段并行线程数"""
+    return _workers
+
+
+def segment_ranges(n_frames, block_frames=BLOCK_FRAMES, segment_frames=SEGMENT_FRAMES):
+    """
+    把帧序号分成固定的段 [(起始帧, 结束帧)]，段长是 block_frames 的整数倍，
+    因此每块的组成与不分段时完全相同
+    """
+    segment_frames = max(block_frames, segment_frames // block_frames * block_frames)
+    return [(start, min(start + segment_frames, n_frames)) for start in range(0, n_frames, segment_frames)]
+
+
+class _Checkpoint:
+    def __init__(self, cache, key):
+        """
+        一组变换的检查点（分析缓存或检查点目录中的一个条目）：从第一帧起连续算完的帧的幅值列，
+        已完成各段的能量，以及正在计算的那一段已累加的能量（按块保存，停止时最多损失一块）
+
+        参数:
+            cache: AnalysisCache
+            key: 条目的键
+        """
+        self.cache = cache
+        self.key = key
+
+    def load(self, mag, partial, progress, segments):
+        """
+        把检查点恢复到 mag、partial（各段能量）和 progress（各段下一块的起始帧）中
+
+        返回:
+            已完成的完整段数
+        """
+        if not self.cache.contains(self.key):
+            return 0
+        state = self.cache.get(self.key)
+        if state is None or 'frames_done' not in state:
+            return 0    # 读取失败，或旧版本（按段保存）的检查点
+        n_done, frames_done = int(state['n_done']), int(state['frames_done'])
+        if mag is not None:
+            mag[:, :frames_done] = state['mag']
+        if 'energy' in state:
+            partial[:n_done] = list(state['energy'])
+        if n_done < len(segments) and frames_done > segments[n_done][0]:
+            progress[n_done] = frames_done
+            if 'energy_partial' in state:
+                partial[n_done] = state['energy_partial']
+        print(f"从检查点继续: 已完成 {frames_done}/{segments[-1][1]} 帧")
+        return n_done
+
+    def save(self, mag, partial, progress, segments, done):
+        """保存从第一帧起连续完成的部分（完整的段，加上下一段中已算完的块）"""
+        n_done = 0
+        while n_done < len(done) and done[n_done]:
+            n_done += 1
+        frames_done = segments[n_done - 1][1] if n_done else 0
+        if n_done < len(segments):
+            frames_done = progress[n_done]
+        if frames_done == 0:
+            return
+        arrays = {'n_done': n_done, 'frames_done': frames_done}
+        if mag is not None:
+            arrays['mag'] = mag[:, :frames_done]
+        if n_done and partial[0] is not None:
+            arrays['energy'] = np.stack(partial[:n_done])
+        if n_done < len(segments) and partial[n_done] is not None and frames_done > segments[n_done][0]:
+            arrays['energy_partial'] = partial[n_done]
+        if sum(np.asarray(a).nbytes for a in arrays.values()) > CHECKPOINT_MAX_BYTES:
+            return
+        self.cache.put(self.key, **arrays)
+        print(f"已保存检查点: {frames_done}/{segments[-1][1]} 帧")
+
+    def clear(self):
+        self.cache.remove(self.key)
+
+
+_checkpoint_store = None
+
+
+def checkpoint_store(cache):
+    """
+    保存检查点的位置：分析缓存启用时就是缓存本身，禁用时使用临时目录下的检查点目录
+    """
+    global _checkpoint_store
+    if cache.enabled:
+        return cache
+    if _checkpoint_store is None:
+        _checkpoint_store = analysis_cache.AnalysisCache(CHECKPOINT_DIR, CHECKPOINT_STORE_BYTES)
+    return _checkpoint_store
+
+
+def _source_identity(audio):
+    """检查点对应的音频：内容哈希，没有时用文件路径、大小和修改时间；内存中的采样返回 None"""
+    if audio.content_hash:
+        return audio.content_hash
+    if audio.path and os.path.exists(audio.path):
+        stat = os.stat(audio.path)
+        return f"{os.path.abspath(audio.path)}:{stat.st_size}:{stat.st_mtime_ns}"
+    return None
+
+
+def decimation_factor(sr, n_fft, hop_length, max_freq):
+    """
+    多速率模式的抽取倍数：窗口和帧移都必须能整除（保证频率网格和帧位置不变），
+    且 max_freq 要落在抽取后低通滤波器的平坦通带内
+
+    返回:
+        抽取倍数，1 表示不抽取
+    """
+    limit = int(MULTIRATE_BAND * sr / (2 * max_freq)) if max_freq else 1
+    for factor in range(limit, 1, -1):
+        if n_fft % factor == 0 and hop_length % factor == 0:
+            return factor
+    return 1
+
+
+def target_rows(step_hz, max_freq, sr, n_fft):
+    """
+    目标频率及其对应的bin索引
+
+    返回:
+        target_freq: 0 到 min(max_freq, 奈奎斯特) 每 step_hz 一个点
+        idx: 每个目标频率最近的bin
+    """
+    nyquist = sr / 2                           # 奈奎斯特频率（理论最大频率）
+    bin_width = sr / n_fft                     # 每个频率bin的宽度
+    actual_max_freq = nyquist if max_freq is None else min(max_freq, nyquist)
+    target_freq = np.arange(0, actual_max_freq + 1, step_hz)
+    idx = np.clip(np.round(target_freq / bin_width).astype(int), 0, n_fft // 2)
+    return target_freq, idx
+
+
+def _run_group(y, sr, n_fft, hop_length, center, scaling, requests, block_frames, factor=1, n_samples=None,
+               workers=1, checkpoint=None, plan=fft_tuner.DEFAULT_PLAN):
+    """
+    对共用同一窗口的请求执行一次分块FFT（帧数足够多时分段在 workers 个线程中执行）
+    checkpoint 不为 None 时从中恢复已完成的块，被停止时保存进度（见 _Checkpoint）
+    plan 决定FFT实现和线程数（变换长度始终等于窗口大小，目标频率取自同一套bin）
+
+    factor > 1 时 y 是按该倍数抽取后的信号，窗口和帧移同比例缩短，
+    bin宽度 (sr/factor)/(n_fft/factor) 不变；帧数和帧时间按原始采样率计算
+    """
+    frames, times = frame_signal(y, n_fft // factor, hop_length // factor, center)
+    if factor > 1:
+        n_frames = frame_count(n_samples, n_fft, hop_length, center)
+        frames = frames[:n_frames]
+        times = frame_times(len(frames), n_fft, hop_length, center)
+    window = analysis_window(n_fft // factor, scaling, frames.dtype.type)
+
+    # 幅值请求只需要到最高目标频率为止的bin
+    rows = {}
+    for req in requests:
+        if req.output == 'magnitude':
+            rows[id(req)] = target_rows(req.step_hz, req.max_freq, sr, n_fft)
+    n_rows = max((idx.max() + 1 for _, idx in rows.values()), default=0)
+    want_energy = any(req.output == 'energy' for req in requests)
+
+    mag = np.empty((n_rows, len(frames)), dtype=frames.dtype) if n_rows else None
+
+    segments = segment_ranges(len(frames), block_frames)
+    parallel = workers > 1 and len(frames) >= MIN_PARALLEL_FRAMES
+    fft_workers = 1 if parallel else plan.workers   # 分段并行时FFT本身不再开线程
+    partial = [None] * len(segments)    # 各段的能量和（计算中的段为已累加的部分）
+    progress = [start for start, _ in segments]     # 各段下一块的起始帧
+    done = [False] * len(segments)
+    n_resumed = checkpoint.load(mag, partial, progress, segments) if checkpoint else 0
+    resumed = n_resumed > 0 or (n_resumed < len(segments) and progress[n_resumed] > segments[n_resumed][0])
+    done[:n_resumed] = [True] * n_resumed
+
+    def transform(index):
+        """变换一段帧：幅值写入 mag 的对应列（各段互不重叠），能量和累加在 partial 中，每块后记录进度"""
+        seg_start, seg_end = segments[index]
+        if want_energy and partial[index] is None:
+            partial[index] = np.zeros(n_fft // factor // 2 + 1)   # 始终用 float64 累加
+        energy = partial[index]
+        for start in range(progress[index], seg_end, block_frames):
+            cancellation.check()
+            block = frames[start:min(start + block_frames, seg_end)] * window
+            spec = plan.rfft(block, fft_workers)
+            if want_energy:
+                energy += np.sum(spec.real ** 2 + spec.imag ** 2, axis=0, dtype=np.float64)
+            if n_rows:
+                mag[:, start:start + len(block)] = np.abs(spec[:, :n_rows]).T
+            progress[index] = start + len(block)
+        done[index] = True
+
+    todo = range(n_resumed, len(segments))
+    try:
+        if parallel:
+            with ThreadPoolExecutor(max_workers=min(workers, len(todo) or 1)) as executor:
+                list(executor.map(transform, todo))
+        else:
+            for index in todo:
+                transform(index)
+    except cancellation.Cancelled:
+        if checkpoint:
+            checkpoint.save(mag if n_rows else None, partial, progress, segments, done)
+        raise
+    if checkpoint and resumed:
+        checkpoint.clear()
+    # 各段能量按段的顺序相加（与线程数无关）
+    energy = functools.reduce(np.add, partial) if want_energy else None
+
+    results = {}
+    for req in requests:
+        if req.output == 'energy':
+            freq_bins = np.fft.rfftfreq(n_fft, 1 / sr)
+            results[id(req)] = BinEnergy(freq_bins, energy, n_fft, hop_length)
+        else:
+            target_freq, idx = rows[id(req)]
+            results[id(req)] = SpectrogramGrid(target_freq, times / sr, mag[idx, :], n_fft, hop_length,
+                                               sr, center)
+    return results
+
+
+def analyze(audio, requests, sr=None, block_frames=BLOCK_FRAMES, workers=None):
+    """
+    对同一段音频执行多个STFT请求
+
+    参数:
+        audio: AudioSource，或单声道采样数组（此时必须给出sr）
+        requests: SpectralRequest 列表
+        sr: 采样率（audio为数组时使用）
+        block_frames: 每块帧数
+        workers: 分段并行的线程数，None 使用 set_workers 的设置
+
+    返回:
+        与 requests 一一对应的 SpectrogramGrid / BinEnergy 列表
+    """
+    cache = analysis_cache.get_cache()
+    content_hash = None
+    identity = None     # 检查点的键（缓存禁用时也可以用文件路径识别）
+    if isinstance(audio, AudioSource):
+        y, sr = audio.samples, audio.sr
+        if cache.enabled:
+            content_hash = audio.content_hash
+        identity = _source_identity(audio)
+    else:
+        y = audio
+    # 按当前精度转换一次（解码时已是该精度则不复制），之后分帧、加窗和FFT都保持该类型
+    dtype = precision.real_dtype()
+    y = np.asarray(y, dtype=dtype)
+
+    # 先查分析缓存，只计算未命中的请求
+    results = {}
+    keys = {}
+    fft_plans = fft_tuner.plan_signature() if content_hash else []
+    if content_hash:
+        for req in requests:
+            params = req.cache_params(sr, len(y))
+            if fft_plans:
+                params['fft_plans'] = fft_plans  # 非默认的FFT实现舍入不同
+            if dtype != np.float64:
+                params['precision'] = precision.get_precision()
+            keys[id(req)] = cache.key(content_hash, 'spectrum', params)
+            hit = cache.get(keys[id(req)])
+            if hit is not None:
+                result_type = BinEnergy if req.output == 'energy' else SpectrogramGrid
+                results[id(req)] = result_type.from_arrays(hit)
+
+    # 不写入分析缓存的请求（缓存禁用或没有内容哈希）：各组算完后把结果存入检查点，
+    # 在后面的组中被停止时，继续处理不再重算已完成的组；全部请求完成后删除
+    store = checkpoint_store(cache) if identity else None
+    finished_keys = {}
+    if store is not None:
+        finished_params = {'fft_plans': fft_tuner.plan_signature(), 'precision': precision.get_precision()}
+        for req in requests:
+            if id(req) in results or id(req) in keys:
+                continue
+            key = store.key(identity, 'finished', dict(req.cache_params(sr, len(y)), **finished_params))
+            finished_keys[id(req)] = key
+            state = store.get(key) if store.contains(key) else None
+            if state is not None:
+                result_type = BinEnergy if req.output == 'energy' else SpectrogramGrid
+                results[id(req)] = result_type.from_arrays(state)
+                print("从检查点恢复已完成的请求")
+
+    # 相同 (窗口, 帧移, 分帧方式, 缩放) 的请求共用一次FFT
+    groups = {}
+    for req in requests:
+        if id(req) in results:
+            continue
+        n_fft, hop_length = req.frame_params(sr)
+        key = (n_fft, hop_length, req.center, req.scaling)
+        groups.setdefault(key, []).append(req)
+
+    decimated = {1: y}
+    for index, ((n_fft, hop_length, center, scaling), group) in enumerate(groups.items()):
+        # 整组都是允许多速率的低频幅值请求时才抽取（有一个要全频带就没有意义）；
+        # center=True 时补零按抽取后的半窗计算，n_fft/factor 为奇数时帧位置会偏移，不抽取
+        factor = 1
+        if not center and all(req.multirate and req.output == 'magnitude' and req.max_freq for req in group):
+            factor = decimation_factor(sr, n_fft, hop_length, max(req.max_freq for req in group))
+        if factor not in decimated:
+            decimated[factor] = decimate(y, factor, ftype='iir', zero_phase=True).astype(dtype, copy=False)
+
+        plan = fft_tuner.get_plan(n_fft // factor)
+        if factor > 1:
+            print(f"执行STFT分析，抽取{factor}倍，窗口大小: {n_fft // factor}, 帧移: {hop_length // factor}")
+        else:
+            print(f"执行STFT分析，窗口大小: {n_fft}, 帧移: {hop_length}")
+        checkpoint = None
+        if store is not None:
+            bands = sorted({(req.step_hz, req.max_freq or 0) for req in group if req.output == 'magnitude'})
+            outputs = sorted({req.output for req in group})
+            checkpoint = _Checkpoint(store, store.key(identity, 'checkpoint', {
+                'n_fft': n_fft, 'hop_length': hop_length, 'center': center, 'scaling': scaling,
+                'factor': factor, 'n_samples': len(y), 'bands': bands, 'outputs': outputs,
+                'segment_frames': SEGMENT_FRAMES, 'block_frames': block_frames,
+                'fft_backend': plan.backend, 'precision': precision.get_precision()}))
+        computed = _run_group(decimated[factor], sr, n_fft, hop_length, center, scaling, group,
+                              block_frames, factor, len(y), workers or _workers, checkpoint, plan)
+        results.update(computed)
+        for key, result in computed.items():
+            if key in keys:
+                cache.put(keys[key], **result.to_arrays())
+            elif key in finished_keys and index < len(groups) - 1:
+                arrays = result.to_arrays()
+                if sum(np.asarray(a).nbytes for a in arrays.values()) <= CHECKPOINT_MAX_BYTES:
+                    store.put(finished_keys[key], **arrays)
+    for key in finished_keys.values():
+        store.remove(key)
+    return [results[id(req)] for req in requests]
@@ -0,0 +1,87 @@
+# 每首歌输出目录下的阶段清单 (manifest.json) - 用于断点续跑和增量处理
+# 记录输入文件的大小、修改时间和内容哈希，以及每个已完成阶段使用的参数；
+# 重新处理时只执行输入、参数变化或输出文件缺失的阶段
+import os
+import json
+import datetime
+from audio_source import content_hash
+
+MANIFEST_NAME = 'manifest.json'
+MANIFEST_VERSION = 1
+
+
+def file_fingerprint(path, previous=None):
+    """
+    输入文件的指纹
+
+    参数:
+        path: 文件路径
+        previous: 清单中记录的上一次指纹；大小和修改时间都相同时直接沿用其哈希，不重新读取文件
+
+    返回:
+        {"size", "mtime_ns", "sha256"}
+    """
+    stat = os.stat(path)
+    if previous and previous.get('size') == stat.st_size and previous.get('mtime_ns') == stat.st_mtime_ns:
+        return dict(previous)
+
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': content_hash(path)}
+
+
+class StageManifest:
+    def __init__(self, folder):
+        """
+        读取（或新建）输出目录下的阶段清单
+
+        参数:
+            folder: 歌曲的输出目录，如 data_stft/<name>
+        """
+        self.folder = folder
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.input = None
+        self.stages = {}
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('version') == MANIFEST_VERSION:
+                self.input = data.get('input')
+                self.stages = data.get('stages', {})
+        except (OSError, ValueError):
+            pass  # 没有清单或清单损坏时视为全部阶段未完成
+
+    def set_input(self, fingerprint):
+        """设置输入文件指纹，内容哈希变化时清空所有阶段记录"""
+        if not self.input or self.input.get('sha256') != fingerprint['sha256']:
+            self.stages = {}
+        self.input = fingerprint
+
+    def is_fresh(self, stage, params, outputs):
+        """
+        阶段是否已完成且无需重做
+
+        参数:
+            stage: 阶段名
+            params: 本次运行的阶段参数
+            outputs: 阶段输出的文件名（相对输出目录）
+        """
+        record = self.stages.get(stage)
+        if record is None or record.get('params') != params:
+            return False
+        return all(os.path.exists(os.path.join(self.folder, name)) for name in outputs)
+
+    def record(self, stage, params):
+        """记录一个阶段完成并立即写回清单"""
+        self.stages[stage] = {
+            'params': params,
+            'finished': datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        }
+        self.save()
+
+    def save(self):
+        """写入清单（先写临时文件再替换，中途崩溃不会留下损坏的清单）"""
+        os.makedirs(self.folder, exist_ok=True)
+        data = {'version': MANIFEST_VERSION, 'input': self.input, 'stages': self.stages}
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
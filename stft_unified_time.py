@@ -4,32 +4,42 @@ import sys
 import os
 import numpy as np
 import soundfile as sf
-from scipy.signal import stft
 import pandas as pd
-import librosa
 import matplotlib
 matplotlib.use('Agg')  # 设置后端为非交互式 Agg
 import matplotlib.pyplot as plt
+import re
+import csv
 import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import spectral_engine
+import spec_render
+import spec_store
+import precision
+from spectral_engine import SpectralRequest
+from audio_source import AudioSource, as_audio_source, audio_path, get_audio_info, read_clip
 
 def get_duration_librosa(file_path):
-    """获取音频文件的播放时长"""
-    audio_data, sample_rate = librosa.load(file_path)
-    duration = librosa.get_duration(y=audio_data, sr=sample_rate)
-    return duration
+    """获取音频文件的播放时长（读取文件头，不再解码重采样整个文件）"""
+    return get_audio_info(file_path).duration
 
-def generate_spectrogram(wav_path, output_dir, freq_ranges=None, hop_ms=50, step_hz=10, floor_db=-120.0, csv_digits=3):
+def generate_spectrogram(wav_path, output_dir, freq_ranges=None, hop_ms=50, step_hz=10, floor_db=-120.0, csv_digits=3,
+                         renderer="matplotlib", export_csv=False, sr=None):
     """
     生成多个频率范围的声谱图
 
     参数:
-        wav_path: 音频文件路径
+        wav_path: 音频文件路径、已解码的AudioSource，或内存中的采样数组（如截取的片段，需给出 sr）
         output_dir: 输出目录路径
         freq_ranges: 频率上限列表，默认为[4000, 8000, 20000]
         hop_ms: 帧移（毫秒）
         step_hz: 频率分辨率
         floor_db: dB下限
         csv_digits: CSV保留小数位
+        renderer: "matplotlib" 或 "raster"（快速直接渲染）
+        export_csv: 除 data.spec 外再导出旧格式的 data.csv（文本，体积大、写入慢）
+        sr: wav_path 为采样数组时的采样率
     """
     if freq_ranges is None:
         freq_ranges = [4000, 8000, 20000]
@@ -38,52 +48,40 @@ def generate_spectrogram(wav_path, output_dir, freq_ranges=None, hop_ms=50, step
     path = output_dir
     os.makedirs(path, exist_ok=True)
 
-    # 获取音频时长（用于图像尺寸设置）
-    time_duration = int(get_duration_librosa(wav_path))
+    # 1. 读音频（已解码的 AudioSource 和内存中的采样直接复用）---
+    source = as_audio_source(wav_path, sr)
 
-    # 1. 读音频 ---------------------------------------------------
-    print(f"加载音频文件: {wav_path}")
-    audio, sr = sf.read(wav_path)
-    if audio.ndim > 1:
-        audio = audio.mean(axis=1)  # 转为单声道
+    # 2. STFT（所有频率范围共用一次变换）-------------------------
+    requests = [SpectralRequest(step_hz, hop_ms, max_freq) for max_freq in freq_ranges]
+    grids = spectral_engine.analyze(source, requests)
 
-    # 2. STFT -----------------------------------------------------
-    hop_length = int(sr * hop_ms / 1000)       # 帧移，单位为样本数
-    n_fft = int(round(sr / step_hz))           # 窗口大小，决定频率分辨率
-    n_fft += n_fft % 2                         # 确保是偶数
+    save_spectrograms(grids, freq_ranges, path, get_audio_info(source).duration, hop_ms, step_hz, floor_db,
+                      csv_digits, renderer, export_csv)
 
-    print(f"执行STFT分析，窗口大小: {n_fft}, 帧移: {hop_length}")
-    f, t, Zxx = stft(
-        audio, fs=sr, window="hann",
-        nperseg=n_fft, noverlap=n_fft-hop_length,
-        boundary=None, padded=False
-    )
-    mag = np.abs(Zxx)                          # 幅值谱
 
-    nyquist = sr / 2                           # 奈奎斯特频率（理论最大频率）
-    bin_width = sr / n_fft                     # 每个频率bin的宽度
-
-    # 3. 为每个频率范围生成数据和图像 ----------------------------
-    for max_freq in freq_ranges:
-        # 限制最大频率不超过奈奎斯特频率
-        actual_max_freq = min(max_freq, nyquist)
-        print(f"处理频率范围: 0-{actual_max_freq} Hz")
-
-        # 创建目标频率数组
-        target_freq = np.arange(0, actual_max_freq+1, step_hz)
+def save_spectrograms(grids, freq_ranges, path, duration, hop_ms=50, step_hz=10, floor_db=-120.0, csv_digits=3,
+                      renderer="matplotlib", export_csv=False):
+    """
+    把幅值网格归一化为dB并保存数据和频谱图
 
-        # 获取频率索引
-        idx = np.clip(np.round(target_freq/bin_width).astype(int),
-                      0, len(f)-1)
+    参数:
+        grids: 与 freq_ranges 一一对应的 SpectrogramGrid
+        freq_ranges: 频率上限列表
+        path: 输出目录
+        duration: 音频时长（秒，用于图像尺寸设置）
+        其余参数同 generate_spectrogram
+    """
+    time_duration = int(duration)
 
-        # 提取对应频率范围的数据
-        spec = mag[idx, :]
+    # 3. 为每个频率范围生成数据和图像 ----------------------------
+    for max_freq, grid in zip(freq_ranges, grids):
+        # 目标频率（已限制在奈奎斯特频率以内）、帧时间和对应幅值
+        target_freq, t, spec = grid.freqs, grid.times, grid.mag
+        print(f"处理频率范围: 0-{target_freq[-1]} Hz")
 
         # 4. 线性幅值 → 对数振幅 + dB 下限 ------------------------
-        eps = 1e-10
-        spec_db = 20*np.log10(np.maximum(spec, eps))
-        spec_db -= np.max(spec_db)             # 峰值设为 0 dB
-        spec_db = np.maximum(spec_db, floor_db)# 裁剪到 floor_db
+        # 截取的网格是整首歌频谱的视图，不能原地覆盖，转换到一个新缓冲中
+        spec_db, ref_db = precision.to_db(spec, floor_db)
 
         # 5. 图像尺寸设置 -----------------------------------------
         # 根据频率范围调整图像尺寸
@@ -94,8 +92,12 @@ def generate_spectrogram(wav_path, output_dir, freq_ranges=None, hop_ms=50, step
         else:
             width, height = max(time_duration//3, 20), 12
 
-        # 6. 保存CSV（仅为8000Hz版本保存CSV，与原代码保持一致）---
+        # 6. 保存数据（仅为8000Hz版本保存，与原代码保持一致）------
         if max_freq == 8000:
+            spec_path = f"{path}/data.spec"
+            spec_store.write_store(spec_path, spec_db, grid, floor_db, ref_db)
+            print(f"已保存频谱数据: {spec_path}")
+        if max_freq == 8000 and export_csv:
             time_s = t  # 直接使用STFT返回的时间(秒)
             df = pd.DataFrame(spec_db,
                             index=target_freq,  # 行：频率
@@ -106,48 +108,312 @@ def generate_spectrogram(wav_path, output_dir, freq_ranges=None, hop_ms=50, step
             print(f"已保存CSV: {csv_path}")
 
         # 7. 绘制频谱图 -------------------------------------------
-        plt.figure(figsize=(width, height))
-        plt.imshow(spec_db,
-                origin="lower", aspect="auto",
-                extent=[float(t[0]), float(t[-1]),
-                        float(target_freq[0]), float(target_freq[-1])],
-                cmap="magma", vmin=floor_db, vmax=0)
-        plt.colorbar(label="Amplitude (dB)")
-        plt.xlabel("Time (s)")
-        plt.ylabel("Frequency (Hz)")
-        plt.title(f"Log-Amplitude Spectrogram "
-                f"({step_hz} Hz × {hop_ms} ms, ≤{max_freq} Hz)")
-        plt.tight_layout()
-
-        # 保存图像
         pic_path = f"{path}/data-{max_freq}.png"
-        plt.savefig(pic_path, dpi=150, bbox_inches="tight")
-        plt.close()
+        title = (f"Log-Amplitude Spectrogram "
+                 f"({step_hz} Hz × {hop_ms} ms, ≤{max_freq} Hz)")
+        if renderer == "raster":
+            # 直接着色写PNG，不经过pyplot（线程安全）
+            spec_render.render_spectrogram(pic_path, spec_db, t, target_freq, floor_db, 0, title,
+                                           figsize=(width, height))
+        else:
+            plt.figure(figsize=(width, height))
+            plt.imshow(spec_db,
+                    origin="lower", aspect="auto",
+                    extent=[float(t[0]), float(t[-1]),
+                            float(target_freq[0]), float(target_freq[-1])],
+                    cmap="magma", vmin=floor_db, vmax=0)
+            plt.colorbar(label="Amplitude (dB)")
+            plt.xlabel("Time (s)")
+            plt.ylabel("Frequency (Hz)")
+            plt.title(title)
+            plt.tight_layout()
+            plt.savefig(pic_path, dpi=150, bbox_inches="tight")
+            plt.close()
         print(f"已保存图像: {pic_path}")
 
 
-def main(audio_file, output_dir):
+class SongSpectrum:
+    def __init__(self, path, freq_ranges=None, hop_ms=50, step_hz=10, source=None):
+        """
+        整首歌的幅值网格（与 generate_spectrogram 相同的参数），截取任意时间段时只切片，不再做FFT
+        批量分析（stft_unified）已经算过的歌曲直接从分析缓存读取
+
+        参数:
+            path: 音频文件路径
+            freq_ranges: 频率上限列表，只计算其中最高的一个，其余取前几行
+            hop_ms: 帧移（毫秒）
+            step_hz: 频率分辨率
+            source: 已解码的 AudioSource，None 时读取 path
+        """
+        self.path = path
+        self.freq_ranges = freq_ranges or [4000, 8000, 20000]
+        self.hop_ms = hop_ms
+        self.step_hz = step_hz
+        self.fingerprint = _file_fingerprint(path)
+        source = source or AudioSource.load(path)
+        self.grid, = spectral_engine.analyze(source, [SpectralRequest(step_hz, hop_ms, max(self.freq_ranges))])
+
+    def matches(self, path, freq_ranges, hop_ms, step_hz):
+        """是否对应同一文件（且文件未被修改）和相同参数"""
+        return (self.path == path and self.freq_ranges == freq_ranges and self.hop_ms == hop_ms
+                and self.step_hz == step_hz and self.fingerprint == _file_fingerprint(path))
+
+    def clip(self, start_time, end_time):
+        """返回与 freq_ranges 一一对应的截取网格"""
+        grid = self.grid.clip(start_time, end_time)
+        return [grid.band(max_freq) for max_freq in self.freq_ranges]
+
+
+def _file_fingerprint(path):
+    stat = os.stat(path)
+    return stat.st_size, stat.st_mtime_ns
+
+
+# 最近使用的整首歌频谱（只保留一首，超过大小上限的歌曲不计算整首频谱）
+SONG_SPECTRUM_MAX_BYTES = 256 * 1024 * 1024
+_song_spectrum = None
+_song_spectrum_lock = threading.Lock()
+
+
+def song_spectrum_bytes(path, freq_ranges=None, hop_ms=50, step_hz=10):
+    """估计整首歌频谱网格的大小（字节，只读文件头）"""
+    info = get_audio_info(path)
+    n_fft, hop_length = SpectralRequest(step_hz, hop_ms).frame_params(info.sr)
+    n_frames = spectral_engine.frame_count(info.frames, n_fft, hop_length, False)
+    n_rows = int(min(max(freq_ranges or [4000, 8000, 20000]), info.sr / 2) // step_hz) + 1
+    return n_rows * n_frames * np.dtype(precision.real_dtype()).itemsize
+
+
+def get_song_spectrum(path, freq_ranges=None, hop_ms=50, step_hz=10):
     """
-    主函数
+    取出（或计算）整首歌的频谱；文件被修改后重新计算
+
+    返回:
+        SongSpectrum，网格超过 SONG_SPECTRUM_MAX_BYTES 时返回 None（截取时按片段单独计算）
+    """
+    global _song_spectrum
+    freq_ranges = freq_ranges or [4000, 8000, 20000]
+    with _song_spectrum_lock:
+        if _song_spectrum is None or not _song_spectrum.matches(path, freq_ranges, hop_ms, step_hz):
+            _song_spectrum = None  # 先释放旧网格
+            if song_spectrum_bytes(path, freq_ranges, hop_ms, step_hz) > SONG_SPECTRUM_MAX_BYTES:
+                return None
+            _song_spectrum = SongSpectrum(path, freq_ranges, hop_ms, step_hz)
+        return _song_spectrum
+
+
+def ready_song_spectrum(path, freq_ranges=None, hop_ms=50, step_hz=10):
+    """已经算好的整首歌频谱；没有或正在计算时返回 None（不等待）"""
+    spectrum = _song_spectrum
+    if spectrum is not None and spectrum.matches(path, freq_ranges or [4000, 8000, 20000], hop_ms, step_hz):
+        return spectrum
+    return None
+
+
+def release_song_spectrum():
+    """释放保存的整首歌频谱"""
+    global _song_spectrum
+    with _song_spectrum_lock:
+        _song_spectrum = None
+
+
+def generate_clip_spectrogram(audio_file, start_time, end_time, output_dir, freq_ranges=None, hop_ms=50, step_hz=10,
+                              floor_db=-120.0, csv_digits=3, renderer="matplotlib", export_csv=False, clip=None,
+                              spectrum=None):
+    """
+    生成一个时间段的声谱图：整首歌的频谱已经算好时直接切片（帧位置沿用整首歌的分帧网格，
+    dB按片段重新归一化），否则只读取这一段再做STFT
 
     参数:
         audio_file: 音频文件路径
+        start_time: 开始时间（秒）
+        end_time: 结束时间（秒）
         output_dir: 输出目录路径
+        clip: 已读取的片段 (采样, 采样率)，None 时需要时再读取
+        spectrum: 这首歌的 SongSpectrum，None 时使用已经算好的（如有）
+        其余参数同 generate_spectrogram
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    spectrum = spectrum or ready_song_spectrum(audio_file, freq_ranges, hop_ms, step_hz)
+    if spectrum is not None:
+        save_spectrograms(spectrum.clip(start_time, end_time), spectrum.freq_ranges, output_dir,
+                          end_time - start_time, hop_ms, step_hz, floor_db, csv_digits, renderer, export_csv)
+        return
+    clipped_audio, clip_sr = clip or read_clip(audio_file, start_time, end_time)
+    generate_spectrogram(clipped_audio, output_dir, freq_ranges, hop_ms, step_hz, floor_db, csv_digits, renderer,
+                         export_csv, sr=clip_sr)
+
+
+def clip_output_dir(audio_file, start_time, end_time, output_root="data_stft_time"):
+    """片段的输出目录: <output_root>/<文件名>-<开始>-<结束>s"""
+    base_name = os.path.splitext(os.path.basename(audio_file))[0]
+    return os.path.join(output_root, f"{base_name}-{start_time:.1f}-{end_time:.1f}s")
+
+
+_NUMBER = r'\+?(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?'
+_RANGE_PATTERN = re.compile(rf'({_NUMBER})\s*(?:[,~\-]|\s)\s*({_NUMBER})')
+
+
+def parse_time_ranges(text):
+    """
+    解析多行时间段，每行 "开始,结束"、"开始-结束"、"开始~结束" 或 "开始 结束"（秒），
+    空行和 # 开头的行忽略；数字可以带指数（如 1e-3）
+
+    返回:
+        [(开始, 结束), ...]
+    """
+    ranges = []
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        match = _RANGE_PATTERN.fullmatch(line)
+        if match is None:
+            raise ValueError(f"无法解析的时间段: {line}")
+        ranges.append((float(match.group(1)), float(match.group(2))))
+    return ranges
+
+
+def load_ranges_csv(csv_path, default_file=None, music_dir="music_stft"):
+    """
+    读取时间段CSV，每行 "文件,开始,结束"，或 "开始,结束"（使用 default_file）；
+    首行不是数字时视为表头
+
+    参数:
+        csv_path: CSV文件路径
+        default_file: 没有文件列时使用的音频文件
+        music_dir: 文件列为相对路径且不存在时，在该目录下查找
+
+    返回:
+        {音频文件路径: [(开始, 结束), ...]}
     """
-    # 检查文件格式
-    if not audio_file.lower().endswith('.wav'):
-        print(f"警告: 文件不是.wav格式，可能无法正确处理")
+    jobs = {}
+    with open(csv_path, 'r', encoding='utf-8-sig', newline='') as f:
+        for line_no, row in enumerate(csv.reader(f)):
+            row = [cell.strip() for cell in row if cell.strip()]
+            if not row:
+                continue
+            try:
+                start_time, end_time = float(row[-2]), float(row[-1])
+            except (ValueError, IndexError):
+                if line_no == 0:
+                    continue  # 表头
+                raise ValueError(f"{csv_path} 第{line_no + 1}行无法解析: {row}")
+            audio_file = row[0] if len(row) >= 3 else default_file
+            if audio_file is None:
+                raise ValueError(f"{csv_path} 第{line_no + 1}行没有指定音频文件")
+            if not os.path.exists(audio_file):
+                audio_file = os.path.join(music_dir, audio_file)
+            jobs.setdefault(audio_file, []).append((start_time, end_time))
+    return jobs
 
-    print(f"开始处理音频文件: {audio_file}")
+
+def generate_clip_batch(jobs, output_root="data_stft_time", workers=None, renderer="raster", save_clip=False, log=print,
+                        **kwargs):
+    """
+    批量截取并行写出：每首歌只解码一次、做一次整首歌的STFT，各时间段从中切片；
+    整首歌的频谱超过 SONG_SPECTRUM_MAX_BYTES 时，各时间段从解码好的采样中截取后只对该段做STFT
+
+    参数:
+        jobs: {音频文件路径: [(开始, 结束), ...]}
+        output_root: 输出根目录
+        workers: 并行写出的线程数，None 为CPU核数
+        renderer: "raster"（线程安全，可并行）或 "matplotlib"（pyplot 非线程安全，逐个写出）
+        save_clip: 同时保存截取的音频（从整首歌的采样中截取，保留原声道数）
+        log: 日志输出函数
+        kwargs: 传给 generate_clip_spectrogram 的其他参数（floor_db、export_csv 等）
+
+    返回:
+        [(音频文件, 开始, 结束, 输出目录或 None, 错误信息或 None), ...]
+    """
+    results = []
+    for audio_file, ranges in jobs.items():
+        try:
+            duration = get_audio_info(audio_file).duration
+        except Exception as e:
+            log(f"读取 {audio_file} 失败: {str(e)}")
+            results += [(audio_file, start, end, None, str(e)) for start, end in ranges]
+            continue
+        spectrum_params = (kwargs.get('freq_ranges'), kwargs.get('hop_ms', 50), kwargs.get('step_hz', 10))
+        spectrum = ready_song_spectrum(audio_file, *spectrum_params)
+        try:
+            # 保存音频片段时读取保留声道的整首采样，分析用它混合的单声道，不再重复解码
+            samples = read_clip(audio_file, 0, None) if save_clip else None
+            source = None
+            if spectrum is None:
+                source = as_audio_source(*samples) if samples else AudioSource.load(audio_file)
+                if song_spectrum_bytes(audio_file, *spectrum_params) <= SONG_SPECTRUM_MAX_BYTES:
+                    spectrum = SongSpectrum(audio_file, *spectrum_params, source=source)
+                    source = None  # 之后只用频谱
+        except Exception as e:
+            log(f"读取 {audio_file} 失败: {str(e)}")
+            results += [(audio_file, start, end, None, str(e)) for start, end in ranges]
+            continue
+        log(f"{audio_file}: {len(ranges)} 个时间段" + ("（从整首歌的频谱切片）" if spectrum else "（逐段分析）"))
+
+        def save(time_range):
+            start_time, end_time = time_range
+            if start_time < 0 or end_time <= start_time or end_time > duration + 1e-6:
+                return audio_file, start_time, end_time, None, f"时间段无效（音频时长 {duration:.2f} 秒）"
+            output_dir = clip_output_dir(audio_file, start_time, end_time, output_root)
+            try:
+                clip = None
+                if source is not None:
+                    clip = (source.samples[int(start_time * source.sr):int(end_time * source.sr)], source.sr)
+                generate_clip_spectrogram(audio_file, start_time, end_time, output_dir, renderer=renderer, clip=clip,
+                                          spectrum=spectrum, **kwargs)
+                if save_clip:
+                    song_audio, clip_sr = samples
+                    clipped_audio = song_audio[int(start_time * clip_sr):int(end_time * clip_sr)]
+                    base_name = os.path.splitext(os.path.basename(audio_file))[0]
+                    sf.write(os.path.join(output_dir, f"clipped_{base_name}_{start_time:.1f}-{end_time:.1f}s.wav"),
+                             clipped_audio, clip_sr)
+            except Exception as e:
+                return audio_file, start_time, end_time, None, str(e)
+            return audio_file, start_time, end_time, output_dir, None
+
+        if renderer == "raster":
+            with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+                song_results = list(executor.map(save, ranges))
+        else:
+            song_results = [save(time_range) for time_range in ranges]
+        for _, start_time, end_time, output_dir, error in song_results:
+            if error:
+                log(f"  {start_time:.1f}s - {end_time:.1f}s 失败: {error}")
+            else:
+                log(f"  {start_time:.1f}s - {end_time:.1f}s -> {output_dir}")
+        results += song_results
+    return results
+
+
+def main(audio_file, output_dir, renderer="matplotlib", sr=None):
+    """
+    主函数
+
+    参数:
+        audio_file: 音频文件路径，或内存中的采样数组
+        output_dir: 输出目录路径
+        renderer: "matplotlib" 或 "raster"（快速直接渲染）
+        sr: audio_file 为采样数组时的采样率
+    """
+    if isinstance(audio_file, np.ndarray):
+        print(f"开始处理内存中的音频片段: {len(audio_file) / sr:.2f} 秒")
+    else:
+        print(f"开始处理音频文件: {audio_path(audio_file)}")
     print(f"输出目录: {output_dir}")
 
-    generate_spectrogram(audio_file, output_dir)
+    generate_spectrogram(audio_file, output_dir, renderer=renderer, sr=sr)
 
     print(f"STFT分析完成，结果保存在: {output_dir}")
 
 if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "--ranges":
+        # 批量截取: CSV 每行 "文件,开始,结束"
+        generate_clip_batch(load_ranges_csv(sys.argv[2]))
+        sys.exit(0)
     if len(sys.argv) != 3:
         print("用法: python stft_unified_time.py <音频文件路径> <输出目录>")
+        print("      python stft_unified_time.py --ranges <时间段CSV>")
         sys.exit(1)
 
     audio_file = sys.argv[1]
@@ -0,0 +1,29 @@
+# power_spectrum.aggregate_energies 与旧版逐频率点循环（|f - target| <= tol 的bin求和）的对比
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import power_spectrum
+
+
+def aggregate_loop(freq_bins, bin_energy, freq_min, freq_max, freq_step, freq_tolerance):
+    # 旧 power.py 的实现
+    frequencies = np.arange(freq_min, freq_max + 1, freq_step)
+    energies = []
+    for target_freq in frequencies:
+        indices = np.where(np.abs(freq_bins - target_freq) <= freq_tolerance)[0]
+        energies.append(np.sum(bin_energy[indices]) if len(indices) else 0)
+    return frequencies, np.array(energies, dtype=float)
+
+
+rng = np.random.default_rng(0)
+# 1Hz 网格（44100 和 48000 Hz 下 bin 正好落在整数频率上，容差边界上有浮点舍入）以及非整数bin宽度
+for sr, n_fft in ((44100, 44100), (48000, 48000), (44100, 4410), (22050, 22052)):
+    freq_bins = np.fft.rfftfreq(n_fft, 1 / sr)
+    bin_energy = rng.random(len(freq_bins))
+    for step, tolerance in ((1, 1.0), (10, 4.0), (3, 0.5)):
+        expected = aggregate_loop(freq_bins, bin_energy, 0, 20000, step, tolerance)
+        result = power_spectrum.aggregate_energies(freq_bins, bin_energy, 0, 20000, step, tolerance)
+        assert np.array_equal(result[0], expected[0])
+        assert np.allclose(result[1], expected[1], rtol=1e-12, atol=0), (sr, n_fft, step, tolerance)
+        print(f"sr={sr} n_fft={n_fft} 步长={step} 容差={tolerance}: 一致")
@@ -0,0 +1,47 @@
+# spectral_engine 与旧脚本的公式对比（stft.py: scipy.signal.stft boundary=None, padded=False；
+# power.py: librosa.stft center=True, hann, 不缩放），用合成信号，不需要音频文件
+import os
+import sys
+import numpy as np
+import librosa
+from scipy.signal import stft
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import spectral_engine
+from spectral_engine import SpectralRequest
+from audio_source import AudioSource
+
+sr = 44100
+t = np.arange(sr * 3) / sr
+y = 0.5 * np.sin(2 * np.pi * 1000 * t) + 0.2 * np.sin(2 * np.pi * 6123.4 * t)
+y += 0.01 * np.random.default_rng(0).standard_normal(len(t))
+
+# 不带内容哈希的 AudioSource 不读写分析缓存
+source = AudioSource(None, y, sr, 1)
+grid, energy = spectral_engine.analyze(source, [SpectralRequest(10, 50, 8000),
+                                               SpectralRequest(1, 25, center=True, scaling=None, output='energy')])
+
+# 1. 幅值网格（旧 stft.py 的步骤 2、3）
+hop_length = int(sr * 50 / 1000)
+n_fft = int(round(sr / 10))
+n_fft += n_fft % 2
+f, times, Zxx = stft(y, fs=sr, window="hann", nperseg=n_fft, noverlap=n_fft - hop_length,
+                     boundary=None, padded=False)
+target_freq = np.arange(0, 8000 + 1, 10)
+idx = np.clip(np.round(target_freq / (sr / n_fft)).astype(int), 0, len(f) - 1)
+spec = np.abs(Zxx)[idx, :]
+assert grid.mag.shape == spec.shape, (grid.mag.shape, spec.shape)
+assert np.allclose(grid.freqs, target_freq)
+assert np.allclose(grid.times, times)
+assert np.allclose(grid.mag, spec, rtol=1e-6, atol=1e-12), np.abs(grid.mag - spec).max()
+print(f"幅值网格一致: {spec.shape}, 最大差异 {np.abs(grid.mag - spec).max():.2e}")
+
+# 2. 能量谱（旧 power.py 的 STFT 和能量求和）
+hop_length = int(sr * 25 / 1000)
+n_fft = int(round(sr / 1))
+n_fft += n_fft % 2
+D = librosa.stft(y, n_fft=n_fft, hop_length=hop_length, window='hann')
+power = (np.abs(D) ** 2).sum(axis=1)
+assert np.allclose(energy.freq_bins, librosa.fft_frequencies(sr=sr, n_fft=n_fft))
+assert np.allclose(energy.energy, power, rtol=1e-6, atol=power.max() * 1e-12)
+print(f"能量谱一致: {len(power)} 个bin, 最大相对差异 "
+      f"{np.abs(energy.energy - power).max() / power.max():.2e}")
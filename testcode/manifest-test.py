@@ -0,0 +1,45 @@
+# 阶段清单：输出齐全且参数不变时为最新，参数变化、输出缺失或输入内容变化时需要重做
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import analysis_pool
+from stage_manifest import StageManifest, file_fingerprint
+
+with tempfile.TemporaryDirectory() as folder:
+    song = os.path.join(folder, 'song.wav')
+    with open(song, 'wb') as f:
+        f.write(b'RIFF' + bytes(1000))
+    output = os.path.join(folder, 'out')
+    options = {'renderer': 'raster'}
+
+    manifest = StageManifest(output)
+    manifest.set_input(file_fingerprint(song))
+    assert analysis_pool.stale_stages(manifest, options) == set(analysis_pool.STAGES)
+
+    # 记录全部阶段并创建输出文件后，重新读取的清单中没有需要重做的阶段
+    os.makedirs(output)
+    for name, stage in analysis_pool.STAGES.items():
+        if stage.outputs is not None:
+            for file_name in stage.output_names(options):
+                open(os.path.join(output, file_name), 'w').close()
+            manifest.record(name, stage.run_params(options))
+    manifest = StageManifest(output)
+    manifest.set_input(file_fingerprint(song, manifest.input))
+    assert analysis_pool.stale_stages(manifest, options) == set()
+
+    # 渲染方式变化：两个频谱图阶段需要重做，能量阶段不受影响
+    assert analysis_pool.stale_stages(manifest, {'renderer': 'matplotlib'}) == {'stft', 'stft_3000'}
+
+    # 输出缺失：只重做该阶段及其依赖的中间阶段
+    os.remove(os.path.join(output, 'frequency_energy.png'))
+    assert analysis_pool.stale_stages(manifest, options) == {'power_plt', 'energy'}
+
+    # 输入内容变化：全部重做
+    with open(song, 'wb') as f:
+        f.write(b'RIFF' + bytes(999) + b'\1')
+    stat = os.stat(song)
+    os.utime(song, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))   # 保证修改时间变化
+    manifest.set_input(file_fingerprint(song, manifest.input))
+    assert analysis_pool.stale_stages(manifest, options) == set(analysis_pool.STAGES)
+    print("阶段清单检查通过")
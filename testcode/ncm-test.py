@@ -0,0 +1,77 @@
+# ncm_decrypt 解析和解密一个合成的NCM文件（测试中用纯Python实现AES加密来构造文件）
+import os
+import sys
+import json
+import base64
+import struct
+import tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import ncm_decrypt
+from ncm_decrypt import _SBOX, _round_keys, _gmul, _keystream
+
+
+def encrypt_block(block, keys):
+    state = [b ^ k for b, k in zip(block, keys[0])]
+    for rnd in range(1, 11):
+        # 字节代换 + 行移位
+        state = [_SBOX[state[r + 4 * ((c + r) % 4)]] for c in range(4) for r in range(4)]
+        if rnd < 10:
+            mixed = []
+            for c in range(4):
+                a0, a1, a2, a3 = state[4 * c:4 * c + 4]
+                mixed += [_gmul(a0, 2) ^ _gmul(a1, 3) ^ a2 ^ a3,
+                          a0 ^ _gmul(a1, 2) ^ _gmul(a2, 3) ^ a3,
+                          a0 ^ a1 ^ _gmul(a2, 2) ^ _gmul(a3, 3),
+                          _gmul(a0, 3) ^ a1 ^ a2 ^ _gmul(a3, 2)]
+            state = mixed
+        state = [b ^ k for b, k in zip(state, keys[rnd])]
+    return bytes(state)
+
+
+def aes_ecb_encrypt(data, key):
+    pad = 16 - len(data) % 16
+    data += bytes([pad]) * pad
+    keys = _round_keys(key)
+    return b''.join(encrypt_block(data[i:i + 16], keys) for i in range(0, len(data), 16))
+
+
+# FIPS-197 附录C.1 的测试向量
+key = bytes(range(16))
+plain = bytes.fromhex('00112233445566778899aabbccddeeff')
+assert encrypt_block(plain, _round_keys(key)).hex() == '69c4e0d86a7b0430d8cdb78070b4c55a'
+assert ncm_decrypt.aes_ecb_decrypt(aes_ecb_encrypt(plain, key), key) == plain
+
+audio_key = b'0123456789abcdef' * 4 + b'E7fT49x7dof9OKCgg9cdvhEuezy3iZCL1nFvBFd1T4uSktAJKmwZXsijPbijliionVUXXg9plTbXEclAE9Lb'
+meta = {'musicName': '测试', 'format': 'flac', 'duration': 1000}
+audio = os.urandom(300000)
+
+key_data = bytes(b ^ 0x64 for b in aes_ecb_encrypt(b'neteasecloudmusic' + audio_key, ncm_decrypt.CORE_KEY))
+meta_text = aes_ecb_encrypt(b'music:' + json.dumps(meta).encode('utf-8'), ncm_decrypt.META_KEY)
+meta_data = bytes(b ^ 0x63 for b in b"163 key(Don't modify):" + base64.b64encode(meta_text))
+cover = b'\xff\xd8' + os.urandom(1000)
+stream = _keystream(audio_key)
+encrypted = bytes(b ^ int(stream[i % 256]) for i, b in enumerate(audio))
+
+with tempfile.TemporaryDirectory() as folder:
+    path = os.path.join(folder, 'song.ncm')
+    with open(path, 'wb') as f:
+        f.write(ncm_decrypt.MAGIC + b'\x01\x70')
+        f.write(struct.pack('<I', len(key_data)) + key_data)
+        f.write(struct.pack('<I', len(meta_data)) + meta_data)
+        f.write(b'\0' * 5 + struct.pack('<II', len(cover), len(cover)) + cover)
+        f.write(encrypted)
+
+    assert ncm_decrypt.is_ncm(path)
+    ncm = ncm_decrypt.NcmFile(path)
+    assert ncm.meta == meta and ncm.format == 'flac' and ncm.audio_size == len(audio)
+    assert b''.join(ncm.iter_audio(block_size=4096)) == audio
+    with ncm.open() as reader:
+        reader.seek(123457)
+        assert reader.read(1000) == audio[123457:124457]
+        reader.seek(-10, os.SEEK_END)
+        assert reader.read() == audio[-10:]
+    output = ncm.decrypt_to_file()
+    assert output.endswith('.flac')
+    with open(output, 'rb') as f:
+        assert f.read() == audio
+    print(f"NCM 解密一致: {len(audio)} 字节, 元数据 {ncm.meta}")
@@ -0,0 +1,31 @@
+# spec_store 写入后以内存映射读回（数据、频率、帧时间、片段偏移）
+import os
+import sys
+import tempfile
+import numpy as np
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import spectral_engine
+from spectral_engine import SpectralRequest
+from spec_store import write_store, SpectrogramStore
+from precision import to_db
+from audio_source import AudioSource
+
+sr = 22050
+y = np.random.default_rng(0).standard_normal(sr * 4)
+grid, = spectral_engine.analyze(AudioSource(None, y, sr, 1), [SpectralRequest(10, 50, 4000)])
+
+with tempfile.TemporaryDirectory() as folder:
+    for name, part in (('full', grid), ('clip', grid.clip(1.234, 3.0))):
+        spec_db, ref_db = to_db(part.mag, -120.0)
+        path = os.path.join(folder, name + '.spec')
+        write_store(path, spec_db, part, -120.0, ref_db, chunk_frames=7)   # 多次分块写入
+        store = SpectrogramStore(path)
+        assert isinstance(store.data, np.memmap)
+        assert np.array_equal(store.data, spec_db.T.astype(np.float32))
+        assert np.allclose(store.freqs, part.freqs)
+        assert np.allclose(store.times, part.times)
+        assert store.floor_db == -120.0 and store.ref_db == ref_db
+        times, freqs, values = store.window(1.5, 2.5, 100, 200)
+        assert values.shape == (len(times), len(freqs)) and times.min() >= 1.5 and freqs.max() <= 200
+        print(f"{name}: {store.data.shape} 读回一致")
+        del store
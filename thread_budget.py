@@ -0,0 +1,88 @@
+# 线程预算 - 在外层（同时处理的歌曲数）和内层（单个长信号的分段FFT线程）之间分配CPU核心，
+# 并把 BLAS/OpenMP/numba 等原生库自带的线程池限制为1，避免 工作数 × 库线程数 远超核心数
+# 歌曲多时每个工作单线程；歌曲少（如一个很长的录音）时把剩余核心给FFT
+import os
+import sys
+import spectral_engine
+from audio_source import get_audio_info
+
+try:
+    import threadpoolctl
+except ImportError:
+    threadpoolctl = None  # 没有 threadpoolctl 时只能通过环境变量影响之后启动的子进程
+
+MIN_HOP_MS = 25  # 各阶段中最密的帧移（1Hz能量谱），决定一首歌最多有多少帧
+
+# 原生库线程数的环境变量（在导入numpy之前设置才生效，用于之后以spawn方式启动的子进程）
+NATIVE_THREAD_ENV = ('OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS', 'NUMEXPR_NUM_THREADS',
+                     'VECLIB_MAXIMUM_THREADS', 'NUMBA_NUM_THREADS')
+
+
+class ThreadBudget:
+    def __init__(self, outer, inner):
+        """
+        核心分配
+
+        参数:
+            outer: 外层并行数（同时处理的歌曲）
+            inner: 每首歌的FFT线程数
+        """
+        self.outer = outer
+        self.inner = inner
+
+    def __repr__(self):
+        return f"{self.outer} 个工作 × {self.inner} 个FFT线程"
+
+
+def song_durations(paths):
+    """各文件的时长（秒，只读文件头；读不到的按0计）"""
+    durations = []
+    for path in paths:
+        try:
+            durations.append(get_audio_info(path).duration)
+        except Exception:
+            durations.append(0)
+    return durations
+
+
+def plan(durations, cores=None, max_outer=None):
+    """
+    根据任务规模分配核心
+
+    参数:
+        durations: 每首歌的时长（秒）
+        cores: 可用核心数，默认 os.cpu_count()
+        max_outer: 外层并行数上限（如界面上设置的线程数）
+
+    返回:
+        ThreadBudget
+    """
+    cores = cores or os.cpu_count() or 1
+    outer = max(1, min(cores, len(durations), max_outer or cores))
+    inner = max(1, cores // outer)
+    # 短歌曲的帧数不足以分段并行（见 spectral_engine.MIN_PARALLEL_FRAMES），多给线程也用不上
+    if durations and max(durations) * 1000 / MIN_HOP_MS < spectral_engine.MIN_PARALLEL_FRAMES:
+        inner = 1
+    return ThreadBudget(outer, inner)
+
+
+def limit_native_threads(n=1):
+    """
+    限制当前进程中原生库的线程池
+
+    参数:
+        n: 线程数
+    """
+    for name in NATIVE_THREAD_ENV:
+        os.environ[name] = str(n)
+    if threadpoolctl is not None:
+        threadpoolctl.threadpool_limits(n)
+    if 'numba' in sys.modules:
+        import numba
+        numba.set_num_threads(min(n, numba.config.NUMBA_NUM_THREADS))
+
+
+def apply(budget):
+    """在当前进程中应用预算：内层FFT线程数，原生库单线程（并行由外层和分段FFT负责）"""
+    spectral_engine.set_workers(budget.inner)
+    limit_native_threads(1)
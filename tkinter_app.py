@@ -18,6 +18,13 @@ import power
 import power_plt
 import power_aweighted
 import encryption
+import analysis_pool
+import ingest
+import analysis_cache
+import cancellation
+import thread_budget
+import precision
+from audio_source import AudioSource
 
 # 创建一个队列用于线程间通信
 log_queue = queue.Queue()
@@ -30,8 +37,17 @@ worker_thread = None
 cpu_thread = None
 counter = 0
 total_files = 0
-max_workers = min(os.cpu_count(), 4)  # 默认最大线程数，不超过CPU核心数，默认为4
+max_workers = os.cpu_count()  # 默认使用全部核心；进程池模式下同时处理的歌曲数由内存预算限制
+memory_budget_gb = None  # 进程池模式的内存预算(GB)，None 表示启动时可用内存的75%
+analysis_cache_gb = 4  # 分析缓存（cache_stft/）的容量上限(GB)，0 表示禁用
+write_intermediate_wav = False  # True 时先把压缩格式转换为WAV（旧流程），False 时分析时直接经 ffmpeg 管道解码
 thread_executor = None
+spectrogram_renderer = "matplotlib"  # 频谱图渲染方式，"raster" 为快速直接渲染（不经过pyplot，多线程安全）
+processing_backend = "process"  # "process": 进程池（音频经共享内存传递，不受GIL限制），"thread": 线程池
+analysis_precision = "float64"  # 计算精度，"float32" 时音频、频谱和dB网格全程单精度（内存减半，误差见 precision.py）
+export_csv = False  # True 时频谱图阶段除 data.spec 外再导出旧格式的 data.csv（界面中的复选框）
+analysis_pool_instance = None
+ingest_pipeline = None
 
 class RedirectText:
     def __init__(self, text_widget):
@@ -66,7 +82,7 @@ def check_and_create_directories():
 
 def format_files():
     """格式化音乐文件"""
-    music_format.main()
+    music_format.main(write_wav=write_intermediate_wav)
     time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_message = f'{time_str}: Format Finished.\n'
     
@@ -116,6 +132,11 @@ def set_max_workers(val):
     max_workers = min(int(float(val)), os.cpu_count())
     thread_label.config(text=f"处理线程数: {max_workers}")
 
+def set_export_csv():
+    """设置是否导出 data.csv（下一次开始处理时生效）"""
+    global export_csv
+    export_csv = export_csv_var.get()
+
 def process_music_file(name):
     """处理单个音乐文件的函数"""
     global counter
@@ -144,8 +165,11 @@ def process_music_file(name):
                     return False
                 log_queue.put("Processing resumed...\n")
 
+            # 每首歌只解码一次，各阶段共享同一份采样数据
+            source = AudioSource.load(f"music_stft/{name}")
+
             log_queue.put(f'Processing {name}: STFT Unified\n')
-            stft_unified.main(f"music_stft/{name}")  
+            stft_unified.main(source, renderer=spectrogram_renderer, export_csv=export_csv)
             time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             log_msg = f'{time_str}: STFT Finished!\n'
             file.write(log_msg)
@@ -161,7 +185,7 @@ def process_music_file(name):
                 log_queue.put("Processing resumed...\n")
 
             log_queue.put(f'Processing {name}: STFT 3000 Detailed\n')
-            stft_3000_detailed.main(f"music_stft/{name}")  
+            stft_3000_detailed.main(source, renderer=spectrogram_renderer)
             time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             log_msg = f'{time_str}: STFT-3000 Finished!\n'
             file.write(log_msg)
@@ -177,7 +201,7 @@ def process_music_file(name):
                 log_queue.put("Processing resumed...\n")
 
             log_queue.put(f'Processing {name}: Power CSV\n')
-            power.main(f"music_stft/{name}")  
+            power.main(source)
             time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             log_msg = f'{time_str}: STFT-Power-Csv Finished!\n'
             file.write(log_msg)
@@ -193,7 +217,7 @@ def process_music_file(name):
                 log_queue.put("Processing resumed...\n")
 
             log_queue.put(f'Processing {name}: Power PLT\n')
-            power_plt.main(f"music_stft/{name}")  
+            power_plt.main(source)
             time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             log_msg = f'{time_str}: STFT-Power-Plt Finished!\n'
             file.write(log_msg)
@@ -209,7 +233,7 @@ def process_music_file(name):
                 log_queue.put("Processing resumed...\n")
 
             log_queue.put(f'Processing {name}: Power A-Weighted\n')
-            power_aweighted.main(f"music_stft/{name}")
+            power_aweighted.main(source)
             time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
             log_msg = f'{time_str}: STFT-Power-Plt-A-Weighting Finished!\n'
             file.write(log_msg)
@@ -224,12 +248,74 @@ def process_music_file(name):
         log_queue.put(f'Song-{name} Finished! [{counter}/{total_files}]\n')
 
         return True
+    except cancellation.Cancelled:
+        # 停止时正在计算的阶段在分块之间中止（已完成的部分保存为检查点，下次继续）
+        log_queue.put(f"已停止处理: {name}\n")
+        return False
     except Exception as e:
         error_msg = f"Error processing {name}: {str(e)}\n"
         log_queue.put(error_msg)
         print(error_msg)
         return False
 
+def song_folder_name(name):
+    """输出文件夹名称"""
+    return re.sub(r'[<>:"/\\|?*]', '', name).rsplit('.', 1)[0]
+
+def on_song_start(name):
+    """进程池模式：一首歌开始处理前写日志（已有结果保留，由阶段清单决定哪些阶段需要重做）"""
+    time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    name_new = song_folder_name(name)
+    log_queue.put(f'{time_str}: Processing file: {name}\n')
+    os.makedirs(f'data_stft/{name_new}', exist_ok=True)
+    with open(f'log_stft/log_{name_new}.txt', 'a', encoding='utf-8') as file:
+        file.write(f'{time_str}: Program Starting.\n')
+
+def on_stage_done(name, message):
+    """进程池模式：一个阶段完成"""
+    time_str = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log_msg = f'{time_str}: {message}\n'
+    with open(f'log_stft/log_{song_folder_name(name)}.txt', 'a', encoding='utf-8') as file:
+        file.write(log_msg)
+    log_queue.put(log_msg)
+
+def on_song_done(name, ok):
+    """进程池模式：一首歌的所有阶段结束"""
+    global counter
+    if not ok:
+        log_queue.put(f"处理文件时失败，已跳过\n")
+        return
+    # 移动原始文件到处理后的目录（重新处理时清单保留了输出目录，上一次移入的同名文件直接覆盖）
+    os.replace(f'music_stft/{name}', f'data_stft/{song_folder_name(name)}/{name}')
+    counter += 1
+    log_queue.put(f'Song-{name} Finished! [{counter}/{total_files}]\n')
+
+def on_stage_progress(finished_stages, total_stages):
+    """进程池模式：阶段级进度（进度条按阶段前进，标签显示完成的歌曲数）"""
+    process_queue.put((counter, total_files, finished_stages, total_stages))
+
+def run_process_pool(file_list):
+    """导入（解密/转换）线程池与分析进程池流水线并行：每个文件导入完成后立即进入分析"""
+    global analysis_pool_instance, ingest_pipeline
+    budget = int(memory_budget_gb * 1024 ** 3) if memory_budget_gb else None
+    analysis_pool_instance = analysis_pool.AnalysisPool(max_workers, renderer=spectrogram_renderer,
+                                                        log=log_queue.put, memory_budget=budget,
+                                                        cache_max_bytes=int(analysis_cache_gb * 1024 ** 3),
+                                                        precision_name=analysis_precision,
+                                                        export_csv=export_csv)
+    if pause_processing:
+        analysis_pool_instance.pause()
+    ingest_pipeline = ingest.IngestPipeline(write_wav=write_intermediate_wav, log=log_queue.put)
+    try:
+        ready_queue = ingest_pipeline.start(file_list)
+        analysis_pool_instance.run(ready_queue, on_song_start=on_song_start, on_stage_done=on_stage_done,
+                                   on_song_done=on_song_done, on_progress=on_stage_progress,
+                                   total=len(file_list))
+    finally:
+        ingest_pipeline.stop()
+        analysis_pool_instance = None
+        ingest_pipeline = None
+
 def worker_function():
     """后台处理线程函数"""
     global is_running, counter, thread_executor, max_workers
@@ -257,33 +343,45 @@ def worker_function():
             is_running = False
             return
         
-        log_queue.put(f"开始处理 {total_files} 个音乐文件...(使用 {max_workers} 个线程)\n")
+        unit = "个进程" if processing_backend == "process" else "个线程"
+        log_queue.put(f"开始处理 {total_files} 个音乐文件...(使用 {max_workers} {unit})\n")
         
         # 记录开始时间
         start_time = t.time()
         
-        # 使用线程池处理文件
         counter = 0
-        thread_executor = ThreadPoolExecutor(max_workers=max_workers)
-        futures = []
-        
-        for name in file_list:
-            if not is_running:
-                break
-            # 将任务提交到线程池
-            future = thread_executor.submit(process_music_file, name)
-            futures.append(future)
-        
-        # 等待所有任务完成
-        for future in futures:
-            if not is_running:
-                break
-            try:
-                result = future.result()
-                if not result and is_running:  # 如果处理失败但未主动停止
-                    log_queue.put(f"处理文件时失败，已跳过\n")
-            except Exception as e:
-                log_queue.put(f"处理任务异常: {str(e)}\n")
+        analysis_cache.configure(max_bytes=int(analysis_cache_gb * 1024 ** 3))
+        precision.set_precision(analysis_precision)
+        if processing_backend == "process":
+            # 使用进程池处理文件（各阶段在独立进程中并行）
+            run_process_pool(file_list)
+        else:
+            # 按歌曲数和时长在歌曲线程和FFT线程之间分配核心（原生库线程池限制为1）
+            budget = thread_budget.plan(thread_budget.song_durations([f"{directory}/{n}" for n in file_list]),
+                                        max_outer=max_workers)
+            thread_budget.apply(budget)
+            log_queue.put(f"线程分配: {budget}\n")
+            # 使用线程池处理文件
+            thread_executor = ThreadPoolExecutor(max_workers=budget.outer)
+            futures = []
+            
+            for name in file_list:
+                if not is_running:
+                    break
+                # 将任务提交到线程池
+                future = thread_executor.submit(process_music_file, name)
+                futures.append(future)
+            
+            # 等待所有任务完成
+            for future in futures:
+                if not is_running:
+                    break
+                try:
+                    result = future.result()
+                    if not result and is_running:  # 如果处理失败但未主动停止
+                        log_queue.put(f"处理文件时失败，已跳过\n")
+                except Exception as e:
+                    log_queue.put(f"处理任务异常: {str(e)}\n")
         
         # 记录结束时间
         end_time = t.time()
@@ -344,8 +442,12 @@ def update_ui():
         
         # 处理进度队列
         while not process_queue.empty():
-            current, total = process_queue.get_nowait()
-            progress = current / total * 100 if total > 0 else 0
+            current, total, *stages = process_queue.get_nowait()
+            if stages:
+                # 进程池模式按阶段计算进度
+                progress = stages[0] / stages[1] * 100 if stages[1] > 0 else 0
+            else:
+                progress = current / total * 100 if total > 0 else 0
             progress_var.set(progress)
             progress_label.config(text=f"进度: {current}/{total} ({progress:.1f}%)")
         
@@ -374,6 +476,7 @@ def start_processing():
     # 重置状态
     is_running = True
     pause_processing = False
+    cancellation.set_token(cancellation.CancelToken())  # 线程池模式下各阶段在计算分块之间检查
     counter = 0
     progress_var.set(0)
     progress_label.config(text="进度: 0/0 (0.0%)")
@@ -386,13 +489,15 @@ def start_processing():
     # 清空日志区域
     log_text.delete(1.0, tk.END)
 
-    #解密文件
-    log_queue.put("执行解密...\n")
-    encry()
-    
-    # 格式化音乐文件
-    log_queue.put("执行格式化...\n")
-    format_files()
+    if processing_backend != "process":
+        #解密文件
+        log_queue.put("执行解密...\n")
+        encry()
+        
+        # 格式化音乐文件
+        log_queue.put("执行格式化...\n")
+        format_files()
+    # 进程池模式下解密和转换在后台导入流水线中进行，不阻塞界面
     
     # 启动工作线程
     worker_thread = threading.Thread(target=worker_function)
@@ -413,6 +518,19 @@ def toggle_pause():
     
     pause_processing = not pause_processing
     
+    # 线程池模式：正在执行的阶段在下一个计算分块前等待
+    if pause_processing:
+        cancellation.get_token().pause()
+    else:
+        cancellation.get_token().resume()
+
+    # 进程池模式下同步暂停状态到工作进程
+    if analysis_pool_instance:
+        if pause_processing:
+            analysis_pool_instance.pause()
+        else:
+            analysis_pool_instance.resume()
+    
     if pause_processing:
         pause_button.config(text="继续")
         status_label.config(text="状态: 暂停中")
@@ -431,10 +549,16 @@ def stop_processing():
     if messagebox.askyesno("确认停止", "确定要停止处理吗？\n已经处理的文件将不会丢失。"):
         is_running = False
         log_queue.put("正在停止处理...\n")
+        cancellation.get_token().stop()  # 正在执行的阶段在下一个计算分块前中止
         
-        # 关闭线程池
+        # 关闭线程池（尚未开始的歌曲直接取消）
         if thread_executor:
-            thread_executor.shutdown(wait=False)
+            thread_executor.shutdown(wait=False, cancel_futures=True)
+        # 进程池：正在执行的阶段完成后不再开始新阶段，导入也停止
+        if ingest_pipeline:
+            ingest_pipeline.stop()
+        if analysis_pool_instance:
+            analysis_pool_instance.stop()
         
         # 等待主工作线程结束
         if worker_thread and worker_thread.is_alive():
@@ -598,6 +722,12 @@ if __name__ == "__main__":
     thread_scale.set(max_workers)
     thread_scale.pack(side=tk.LEFT, padx=5)
     
+    # 导出 data.csv（文本格式，体积大、写入慢；默认只写 data.spec）
+    export_csv_var = tk.BooleanVar(value=export_csv)
+    export_csv_check = ttk.Checkbutton(thread_frame, text="导出 data.csv", variable=export_csv_var,
+                                       command=set_export_csv)
+    export_csv_check.pack(side=tk.LEFT, padx=15)
+    
     # 信息显示区
     info_frame = ttk.Frame(control_frame)
     info_frame.pack(side=tk.RIGHT)